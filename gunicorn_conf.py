@@ -15,6 +15,9 @@ worker_connections = 1000
 timeout = 120
 keepalive = 5
 
+# Build the catalog in the master before forking so workers share it copy-on-write
+preload_app = os.getenv("PRELOAD_CATALOG", "false").lower() == "true"
+
 # Server mechanics
 daemon = False
 pidfile = None
@@ -36,5 +39,16 @@ proc_name = "esim-global-api"
 def on_starting(server):
     server.log.info("Starting eSIM Global API server")
 
+def when_ready(server):
+    if preload_app:
+        import main
+        main.preload_catalog()
+        server.log.info("Catalog preloaded in master (version %s)", main.data_store.snapshot.version)
+
+def post_fork(server, worker):
+    if preload_app:
+        import main
+        server.log.info("Worker %s memory after fork: %s", worker.pid, main.process_memory())
+
 def on_exit(server):
     server.log.info("Stopping eSIM Global API server") 
\ No newline at end of file
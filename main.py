@@ -1,17 +1,46 @@
 import os
+import gc
 import time
+import base64
+import importlib.util
 import json
+import mmap
 import asyncio
+import hashlib
+import gzip
+import struct
+import zlib
+import heapq
+import codecs
+import re
+import math
+import sys
 import httpx
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from typing import Dict, List, Any, Optional, Union
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Security, status, Body
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Security, status, Body, Request
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from dotenv import load_dotenv
 import random
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+
+try:
+    import brotli  # Optional: adds "br" variants of the cached catalog payloads
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl  # Catalog sharing between workers needs POSIX file locks
+except ImportError:
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
@@ -20,6 +49,15 @@ load_dotenv()
 WORDPRESS_URL = os.getenv("WORDPRESS_URL", "https://wordpress-1368009-5111398.cloudwaysapps.com")
 API_KEY = os.getenv("API_KEY", "")
 REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", "300"))  # Default: refresh every 5 minutes
+CATALOG_WAIT_TIMEOUT = float(os.getenv("CATALOG_WAIT_TIMEOUT", "30"))  # Max time a request waits for an in-flight refresh
+CATALOG_CACHE_FILE = os.getenv("CATALOG_CACHE_FILE", "")  # Last known good catalog, loaded at startup (empty = disabled)
+CATALOG_STREAM_INGEST = os.getenv("CATALOG_STREAM_INGEST", "false").lower() == "true"  # Decode /v1/data records as bytes arrive
+CATALOG_STREAM_CHUNK_SIZE = int(os.getenv("CATALOG_STREAM_CHUNK_SIZE", "262144"))  # Bytes handed to the decoder per step
+CHANGE_FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE", "64"))  # Catalog versions whose diffs are kept for /api/esim-data/changes
+PROJECTION_CACHE_SIZE = int(os.getenv("PROJECTION_CACHE_SIZE", "32"))  # Encoded field projections kept per catalog snapshot
+# Directory (ideally on tmpfs, e.g. /dev/shm/esim-global-api) for sharing the catalog between workers
+SHARED_CATALOG_DIR = os.getenv("SHARED_CATALOG_DIR", "")
+SHARED_CATALOG_POLL_INTERVAL = float(os.getenv("SHARED_CATALOG_POLL_INTERVAL", "2"))
 FASTAPI_API_KEY = os.getenv("FASTAPI_API_KEY", "")
 DEBUG_MODE = os.getenv("DEBUG_MODE", "true").lower() == "true"
 USE_SAMPLE_DATA = os.getenv("CONNECTION_ERROR_TEST", "true").lower() == "true"
@@ -27,10 +65,34 @@ USE_SAMPLE_DATA = os.getenv("CONNECTION_ERROR_TEST", "true").lower() == "true"
 WORDPRESS_APP_USERNAME = os.getenv("WORDPRESS_APP_USERNAME", "rana1")
 WORDPRESS_APP_PASSWORD = os.getenv("WORDPRESS_APP_PASSWORD", "TSQJ TqlX aI1y waL0 VxK0 eHoO")
 
+# Upstream HTTP connection pools
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 is negotiated via ALPN, so upstreams without it stay on HTTP/1.1
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+def _wordpress_auth_headers() -> Dict[str, str]:
+    """Authorization header for WordPress requests, computed once at startup"""
+    # Use app password authentication if configured
+    if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD:
+        # Remove spaces from app password if present
+        app_password = WORDPRESS_APP_PASSWORD.replace(" ", "")
+        auth_string = f"{WORDPRESS_APP_USERNAME}:{app_password}"
+        encoded_auth = base64.b64encode(auth_string.encode()).decode()
+        return {"Authorization": f"Basic {encoded_auth}"}
+    # Fall back to API key if configured
+    if API_KEY:
+        return {"Authorization": f"Bearer {API_KEY}"}
+    return {}
+
+WORDPRESS_AUTH_HEADERS = _wordpress_auth_headers()
+
 print(f"Starting with WordPress URL: {WORDPRESS_URL}")
 print(f"Debug mode: {DEBUG_MODE}")
 print(f"Using sample data: {USE_SAMPLE_DATA}")
 print(f"WordPress REST API Authentication: {'Enabled' if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD else 'Disabled'}")
+print(f"Upstream HTTP/2: {'Enabled' if HTTP2_ENABLED else 'Disabled'}")
 
 # Sample data for development/testing
 SAMPLE_PRODUCTS = [
@@ -65,20 +127,1443 @@ async def root():
 # Security scheme for API Key authentication
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
+# Helper function to serve pre-rendered JSON without re-encoding
+class JSONBytesResponse(Response):
+    """Response for an already encoded JSON body, either bytes or a view into a mapped catalog file"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return content
+
+def json_bytes_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Wrap an already encoded JSON body in a response"""
+    return JSONBytesResponse(content=body, headers=headers)
+
+# Helper function to parse GB value to float 
+def gb_value(gb_str) -> float:
+    """Parse GB string (like '5GB') to float value, raising ValueError if malformed"""
+    return float(str(gb_str).replace('GB', '').replace('gb', '').strip())
+
+def parse_gb(gb_str: str) -> float:
+    """Parse GB string (like '5GB') to float value"""
+    if not gb_str:
+        return 0.0
+    try:
+        return gb_value(gb_str)
+    except ValueError:
+        return 0.0
+
+# Helper function to parse Days value to int
+def parse_days(days_str: str) -> Optional[int]:
+    """Parse Days string (like '30') to int value, None if missing or malformed"""
+    if not days_str:
+        return None
+    try:
+        return int(days_str)
+    except (TypeError, ValueError):
+        return None
+
+# Helper function to parse a Price_USD_* value to float
+def parse_price(price_str) -> float:
+    """Parse a price string (like '29.99') to float, NaN if missing or malformed"""
+    if price_str is None or price_str == "":
+        return math.nan
+    try:
+        price = float(price_str)
+    except (TypeError, ValueError):
+        return math.nan
+    return price if math.isfinite(price) else math.nan
+
+# Price tiers in USD, one Price_USD_<tier> column each; price group N is charged at the Nth tier
+PRICE_TIERS = (5, 10, 15, 20, 25)
+
+def price_tier_index(price_group) -> Optional[int]:
+    """Index into PRICE_TIERS of the tier a price group pays, None for unknown groups"""
+    try:
+        index = int(price_group) - 1
+    except (TypeError, ValueError):
+        return None
+    return index if 0 <= index < len(PRICE_TIERS) else None
+
+# Compact catalog records
+class RecordShape:
+    """Field names shared by every record with the same keys in the same order"""
+    __slots__ = ("keys", "index")
+
+    def __init__(self, keys: tuple):
+        self.keys = keys
+        self.index = {key: position for position, key in enumerate(keys)}
+
+_RECORD_SHAPES: Dict[tuple, RecordShape] = {}
+_MISSING = object()
+
+class CatalogRecord(Mapping):
+    """
+    Read-only product or country record: a shared shape plus a tuple of values.
+
+    Behaves like the dict it was built from (get, [], iteration, equality with
+    dicts) at a fraction of the memory, since the keys live once in the shape.
+    """
+    __slots__ = ("shape", "values")
+
+    def __init__(self, shape: RecordShape, values: tuple):
+        self.shape = shape
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.shape.index[key]]
+
+    def get(self, key, default=None):
+        position = self.shape.index.get(key)
+        return default if position is None else self.values[position]
+
+    def __iter__(self):
+        return iter(self.shape.keys)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, key) -> bool:
+        return key in self.shape.index
+
+    def __eq__(self, other):
+        if isinstance(other, CatalogRecord):
+            if other.shape is self.shape:
+                return other.values == self.values
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return len(other) == len(self.values) and all(
+                other.get(key, _MISSING) == value for key, value in zip(self.shape.keys, self.values)
+            )
+        return NotImplemented
+
+    __hash__ = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.shape.keys, self.values))
+
+    def __repr__(self) -> str:
+        return f"CatalogRecord({self.to_dict()!r})"
+
+def compact_record(record: Dict[str, Any]) -> CatalogRecord:
+    """Pack a record dict into a CatalogRecord, interning keys and short string values"""
+    keys = tuple(record)
+    shape = _RECORD_SHAPES.get(keys)
+    if shape is None:
+        keys = tuple(sys.intern(key) if isinstance(key, str) else key for key in keys)
+        shape = _RECORD_SHAPES.setdefault(keys, RecordShape(keys))
+    values = tuple(
+        sys.intern(value) if type(value) is str and len(value) <= 32 else value
+        for value in record.values()
+    )
+    return CatalogRecord(shape, values)
+
+def validate_record(model, record) -> List[str]:
+    """
+    Check a raw record against its pydantic model, returning the problems found.
+
+    Numbers where the model expects a string are accepted, as WordPress
+    may send either for numeric-looking fields.
+    """
+    if not isinstance(record, dict):
+        return [f"expected an object, got {type(record).__name__}"]
+    try:
+        model.model_validate(record)
+    except ValidationError as e:
+        return [
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+            if not (error["type"] == "string_type" and type(error.get("input")) in (int, float))
+        ]
+    return []
+
+# Catalog snapshot built once per refresh
+def _render_records(records, previous_records=None, previous_json=None, previous_offsets=None):
+    """
+    Render a JSON array of records, reusing fragments of a previous rendering.
+
+    Returns the array and the start offset of each record in it, plus a final
+    sentinel, so record i spans offsets[i]:offsets[i + 1] - 1. Records that are
+    the very same objects as in the previous rendering are copied from it
+    instead of being encoded again.
+    """
+    reuse = {}
+    if previous_offsets is not None and previous_json is not None:
+        reuse = {id(record): index for index, record in enumerate(previous_records)}
+    parts = []
+    offsets = array("q")
+    position = 1
+    for record in records:
+        index = reuse.get(id(record))
+        if index is None:
+            fragment = render_json(record)
+        else:
+            fragment = previous_json[previous_offsets[index]:previous_offsets[index + 1] - 1]
+        offsets.append(position)
+        parts.append(fragment)
+        position += len(fragment) + 1
+    offsets.append(position)
+    return b"[" + b",".join(parts) + b"]", offsets
+
+def _render_catalog_bodies(products, countries, last_updated: Optional[str],
+                           previous: Optional["CatalogSnapshot"] = None) -> Dict[str, Any]:
+    """
+    Render the full catalog response bodies and their ETag.
+
+    /api/esim-data is split around its timestamp so only the timestamp is
+    encoded per request. Records shared with the previous snapshot reuse its
+    encoded JSON.
+    """
+    previous_products = previous_countries = (None, None, None)
+    if previous is not None and previous.product_offsets is not None:
+        products_start = len(b'{"products":')
+        countries_start = len(b'{"countries":')
+        previous_products = (
+            previous.products,
+            bytes(previous.products_body.identity[products_start:products_start + previous.product_offsets[-1]]),
+            previous.product_offsets,
+        )
+        previous_countries = (
+            previous.countries,
+            bytes(previous.countries_body.identity[countries_start:countries_start + previous.country_offsets[-1]]),
+            previous.country_offsets,
+        )
+    products_json, product_offsets = _render_records(products, *previous_products)
+    countries_json, country_offsets = _render_records(countries, *previous_countries)
+    last_updated_json = render_json(last_updated)
+
+    # The ETag is weak because the bodies also carry last_updated/timestamp,
+    # which change without the catalog changing
+    content_hash = hashlib.sha256(products_json)
+    content_hash.update(b"\n")
+    content_hash.update(countries_json)
+
+    return {
+        "products_body": EncodedBody(b'{"products":' + products_json + b',"last_updated":' + last_updated_json + b"}"),
+        "countries_body": EncodedBody(b'{"countries":' + countries_json + b',"last_updated":' + last_updated_json + b"}"),
+        "esim_data_body": TimestampedBody(
+            b'{"products":' + products_json + b',"countries":' + countries_json + b',"timestamp":',
+            b',"last_updated":' + last_updated_json + b"}",
+        ),
+        "etag": f'W/"{content_hash.hexdigest()[:32]}"',
+        "product_offsets": product_offsets,
+        "country_offsets": country_offsets,
+    }
+
+def _build_range_index(column) -> tuple:
+    """Sort positions by a numeric column, skipping missing values, for bisect lookups"""
+    order = sorted((position for position, value in enumerate(column) if value is not None), key=column.__getitem__)
+    keys = [column[position] for position in order]
+    return tuple(keys), tuple(order)
+
+def _range_bounds(range_index: tuple, low=None, high=None) -> tuple:
+    """Slice bounds into a range index's ordering for values in [low, high]"""
+    keys = range_index[0]
+    start = bisect_left(keys, low) if low is not None else 0
+    end = bisect_right(keys, high) if high is not None else len(keys)
+    return start, max(start, end)
+
+def _range_positions(range_index: tuple, low=None, high=None) -> tuple:
+    """Positions whose value lies in [low, high], in ascending value order"""
+    start, end = _range_bounds(range_index, low, high)
+    return range_index[1][start:end]
+
+def _build_price_matrix(products) -> tuple:
+    """One float column per price tier, NaN where a product has no price for the tier"""
+    return tuple(array("d", (parse_price(product.get(f"Price_USD_{tier}")) for product in products)) for tier in PRICE_TIERS)
+
+def _resolve_group_prices(price_matrix: tuple, products_by_price_group: Dict[str, tuple]) -> Dict[str, tuple]:
+    """
+    Effective USD price of every product for the price group it belongs to.
+
+    A product is charged at its group's tier only. Returns, per price group,
+    the product positions with their prices and tier indexes (NaN / -1 when
+    the product has no price in that tier or the group has no tier).
+    """
+    resolved = {}
+    for price_group, positions in products_by_price_group.items():
+        group_tier = price_tier_index(price_group)
+        prices, tiers = array("d"), array("b")
+        for position in positions:
+            price = price_matrix[group_tier][position] if group_tier is not None else math.nan
+            prices.append(price)
+            tiers.append(-1 if math.isnan(price) else group_tier)
+        resolved[price_group] = (positions, prices, tiers)
+    return resolved
+
+def _build_ordering(range_index: tuple, count: int) -> tuple:
+    """
+    Total order of all positions by a range index's column, missing values last.
+
+    Returns the ordered positions and the rank of each position in them;
+    ties keep catalog order.
+    """
+    ranked = set(range_index[1])
+    order = array("l", range_index[1])
+    order.extend(position for position in range(count) if position not in ranked)
+    rank = array("l", bytes(order.itemsize * count))
+    for position_rank, position in enumerate(order):
+        rank[position] = position_rank
+    return order, rank
+
+def _value_range(values) -> Optional[Dict[str, Any]]:
+    values = [value for value in values if value is not None and not (isinstance(value, float) and math.isnan(value))]
+    return {"min": min(values), "max": max(values)} if values else None
+
+def _build_price_group_view(snapshot: "CatalogSnapshot") -> List[Dict[str, Any]]:
+    """Per price group: product and country counts, the group's countries and its price, GB and Days ranges"""
+    countries_by_price_group = _build_index(snapshot.countries, "Price_group", positions=False)
+    view = []
+    for price_group in sorted(group for group in snapshot.products_by_price_group if group):
+        positions, prices, _ = snapshot.group_prices[price_group]
+        country_codes = [country.get("Country_Code") for country in countries_by_price_group.get(price_group, ())]
+        tier = price_tier_index(price_group)
+        price_range = _value_range(prices)
+        view.append({
+            "id": price_group,
+            "price_tier": PRICE_TIERS[tier] if tier is not None else None,
+            "product_count": len(positions),
+            "country_count": len(country_codes),
+            "countries": country_codes,
+            "min_price_usd": price_range["min"] if price_range else None,
+            "max_price_usd": price_range["max"] if price_range else None,
+            "gb": _value_range(snapshot.gb[position] for position in positions),
+            "days": _value_range(snapshot.days[position] for position in positions),
+        })
+    return view
+
+def _json_default(value: Any):
+    if isinstance(value, CatalogRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def render_json(value: Any) -> bytes:
+    """Encode a value the same way FastAPI's JSONResponse does"""
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+                      default=_json_default).encode("utf-8")
+
+# Pre-compressed response bodies
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"  # no name, mtime 0, max compression, unknown OS
+
+class EncodedBody:
+    """A rendered response body together with its compressed variants"""
+    __slots__ = ("identity", "variants")
+
+    def __init__(self, identity: bytes, variants: Optional[Dict[str, bytes]] = None):
+        self.identity = identity
+        if variants is None:
+            variants = {"gzip": gzip.compress(identity, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = brotli.compress(identity, quality=9)
+        self.variants = variants
+
+    @property
+    def encodings(self):
+        return self.variants.keys()
+
+    def render(self, encoding: Optional[str] = None) -> bytes:
+        return self.variants[encoding] if encoding else self.identity
+
+class TimestampedBody:
+    """
+    Body of /api/esim-data, whose timestamp changes on every request.
+
+    The part before the timestamp is compressed once into a gzip member that
+    ends on a sync flush. Per request only the timestamp and the short tail
+    are deflated as independent final blocks and the CRC is extended with
+    zlib.crc32, so a complete gzip body costs a few bytes of compression.
+    """
+    __slots__ = ("head", "tail", "gzip_head", "head_crc")
+    encodings = ("gzip",)
+
+    def __init__(self, head: bytes, tail: bytes, gzip_head: Optional[bytes] = None, head_crc: Optional[int] = None):
+        self.head = head
+        self.tail = tail
+        if gzip_head is None:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            gzip_head = GZIP_HEADER + compressor.compress(head) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            head_crc = zlib.crc32(head)
+        self.gzip_head = gzip_head
+        self.head_crc = head_crc
+
+    def render(self, encoding: Optional[str] = None) -> bytes:
+        rest = str(int(time.time())).encode() + self.tail
+        if not encoding:
+            return b"".join((self.head, rest))
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        trailer = struct.pack("<II", zlib.crc32(rest, self.head_crc), (len(self.head) + len(rest)) & 0xFFFFFFFF)
+        return b"".join((self.gzip_head, compressor.compress(rest), compressor.flush(), trailer))
+
+def negotiate_encoding(accept_encoding: Optional[str], available) -> Optional[str]:
+    """Pick the preferred available content-coding from an Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip()] = weight
+    # Prefer brotli, then gzip, among codings the client accepts
+    for coding in ("br", "gzip"):
+        if coding in available and weights.get(coding, weights.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def _build_index(records, key: str, positions: bool = True) -> Dict[str, tuple]:
+    """Group records (or their positions) by the value of a field"""
+    index: Dict[str, list] = {}
+    for position, record in enumerate(records):
+        value = record.get(key)
+        if value is None or value == "":
+            continue
+        index.setdefault(value, []).append(position if positions else record)
+    return {value: tuple(entries) for value, entries in index.items()}
+
+class Projection:
+    """
+    Records of one catalog section reduced to some fields, encoded once.
+
+    Keeps the encoded JSON array with per-record offsets so pages are byte
+    slices, plus lazily built full response bodies.
+    """
+    __slots__ = ("json", "offsets", "bodies")
+
+    def __init__(self, json_array: bytes, offsets):
+        self.json = json_array
+        self.offsets = offsets
+        self.bodies: Dict[str, Any] = {}
+
+    @classmethod
+    def render(cls, records, fields: Optional[tuple] = None, drop_nulls: bool = False) -> "Projection":
+        wanted = frozenset(fields) if fields else None
+        projected = [
+            {key: value for key, value in record.items()
+             if (wanted is None or key in wanted) and not (drop_nulls and value is None)}
+            for record in records
+        ]
+        return cls(*_render_records(projected))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def slice(self, start: int, end: int) -> bytes:
+        """Encoded JSON array of records start..end-1"""
+        if end <= start:
+            return b"[]"
+        return b"[" + self.json[self.offsets[start]:self.offsets[end] - 1] + b"]"
+
+class CatalogSnapshot:
+    """
+    Immutable, indexed view of the products and countries from a single refresh.
+
+    A snapshot is never modified after it is built; a refresh builds a new one
+    and swaps it into the data store, so a request that holds a snapshot always
+    sees products and countries from the same refresh. The JSON bodies of the
+    full catalog endpoints are rendered and compressed once here and served
+    as bytes.
+    """
+    __slots__ = (
+        "version", "products", "countries", "last_updated",
+        "products_by_id", "products_by_price_group", "products_by_provider",
+        "countries_by_code", "countries_by_region", "countries_by_continent",
+        "days", "gb", "days_index", "gb_index",
+        "products_body", "countries_body", "esim_data_body",
+        "etag", "last_modified", "last_modified_ts",
+        "product_offsets", "country_offsets", "source_validators", "quarantine",
+        "price_matrix", "group_prices", "offers_bodies", "prices", "orderings", "projections",
+        "price_groups_body", "changes",
+    )
+
+    def __init__(self, version: int, products, countries, last_updated: Optional[str],
+                 rendered: Optional[Dict[str, Any]] = None, previous: Optional["CatalogSnapshot"] = None,
+                 source_validators: Optional[Dict[str, Optional[str]]] = None,
+                 quarantine: Optional[Dict[str, Any]] = None, changes: Optional["CatalogDiff"] = None):
+        # Records validated at ingest are already compact; sample and cached data are packed here
+        products = tuple(p if isinstance(p, CatalogRecord) else compact_record(p) for p in products if isinstance(p, Mapping))
+        countries = tuple(c if isinstance(c, CatalogRecord) else compact_record(c) for c in countries if isinstance(c, Mapping))
+
+        # First occurrence wins, matching the previous linear scans
+        products_by_id = {}
+        for product in products:
+            products_by_id.setdefault(product.get("Product_id"), product)
+        countries_by_code = {}
+        for country in countries:
+            countries_by_code.setdefault(country.get("Country_Code"), country)
+
+        set_field = super().__setattr__
+        set_field("version", version)
+        set_field("products", products)
+        set_field("countries", countries)
+        set_field("last_updated", last_updated)
+        set_field("products_by_id", products_by_id)
+        set_field("products_by_price_group", _build_index(products, "Price_group"))
+        set_field("products_by_provider", _build_index(products, "Provider_id"))
+        set_field("countries_by_code", countries_by_code)
+        set_field("countries_by_region", _build_index(countries, "Country_Region", positions=False))
+        set_field("countries_by_continent", _build_index(countries, "Continent", positions=False))
+
+        # Numeric columns parsed once at ingest, with sorted orderings for range filters
+        days = tuple(parse_days(product.get("Days")) for product in products)
+        gb = tuple(parse_gb(product.get("GB")) for product in products)
+        set_field("days", days)
+        set_field("gb", gb)
+        set_field("days_index", _build_range_index(days))
+        set_field("gb_index", _build_range_index(gb))
+
+        # Price tiers as numeric columns and each price group's resolved prices,
+        # so country offers need no string parsing or joins per request
+        price_matrix = _build_price_matrix(products)
+        set_field("price_matrix", price_matrix)
+        group_prices = _resolve_group_prices(price_matrix, self.products_by_price_group)
+        set_field("group_prices", group_prices)
+        set_field("offers_bodies", {})
+        # Field projections requested by clients, least recently used evicted first
+        set_field("projections", OrderedDict())
+        set_field("price_groups_body", EncodedBody(render_json({
+            "price_groups": sorted(group for group in self.products_by_price_group if group),
+            "groups": _build_price_group_view(self),
+            "last_updated": last_updated,
+        })))
+
+        # Every product's resolved price, and per sort key the positions in
+        # ascending order plus each position's rank in it, for top-k queries
+        prices = array("d", [math.nan]) * len(products)
+        for positions, group_price_column, _ in group_prices.values():
+            for position, price in zip(positions, group_price_column):
+                prices[position] = price
+        set_field("prices", prices)
+        set_field("orderings", {
+            "days": _build_ordering(self.days_index, len(products)),
+            "gb": _build_ordering(self.gb_index, len(products)),
+            "price": _build_ordering(_build_range_index(tuple(None if math.isnan(price) else price for price in prices)), len(products)),
+        })
+
+        # Response bodies are rendered once per snapshot, unless they were
+        # already rendered by the worker that published a shared snapshot
+        if rendered is None:
+            rendered = _render_catalog_bodies(products, countries, last_updated, previous)
+        set_field("products_body", rendered["products_body"])
+        set_field("countries_body", rendered["countries_body"])
+        set_field("esim_data_body", rendered["esim_data_body"])
+        set_field("etag", rendered["etag"])
+        set_field("product_offsets", rendered.get("product_offsets"))
+        set_field("country_offsets", rendered.get("country_offsets"))
+        # ETag / Last-Modified / payload hash of the WordPress response this snapshot came from
+        set_field("source_validators", source_validators)
+        # Diff from the previous version, None when it is not known (sample data, cold start)
+        set_field("changes", changes)
+        # Rows rejected by validation at ingest: counts per section and the first few problems
+        set_field("quarantine", quarantine or {"products": 0, "countries": 0, "samples": []})
+
+        last_modified = None
+        if last_updated:
+            try:
+                last_modified = datetime.strptime(last_updated, "%Y-%m-%d %H:%M:%S").astimezone(timezone.utc)
+            except ValueError:
+                pass
+        set_field("last_modified", format_datetime(last_modified, usegmt=True) if last_modified else None)
+        set_field("last_modified_ts", int(last_modified.timestamp()) if last_modified else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CatalogSnapshot is immutable")
+
+    @property
+    def digest(self) -> str:
+        """Digest of the content, the same in every worker and process serving this catalog"""
+        return self.etag[3:19]
+
+    @property
+    def version_token(self) -> str:
+        """
+        Version plus a digest of the content (X-Catalog-Version).
+
+        Version numbers restart with the process and are counted per worker
+        unless the catalog is shared, so the number alone does not identify
+        a catalog.
+        """
+        return f"{self.version}-{self.digest}"
+
+    def cache_headers(self) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        return headers
+
+    def is_not_modified(self, request: Request) -> bool:
+        """Evaluate If-None-Match / If-Modified-Since against this snapshot"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # Weak comparison; If-Modified-Since is ignored when If-None-Match is present
+            current = self.etag[2:]
+            for tag in if_none_match.split(","):
+                tag = tag.strip()
+                if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == current:
+                    return True
+            return False
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified_ts is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.last_modified_ts <= since.timestamp()
+        return False
+
+    def products_at(self, positions) -> List[Dict[str, Any]]:
+        """Resolve product positions from an index into product records"""
+        products = self.products
+        return [products[position] for position in positions]
+
+    def days_range(self, min_days: Optional[int] = None, max_days: Optional[int] = None) -> tuple:
+        """Positions of products whose Days lies within the given bounds"""
+        return _range_positions(self.days_index, min_days, max_days)
+
+    def gb_range(self, min_gb: Optional[float] = None, max_gb: Optional[float] = None) -> tuple:
+        """Positions of products whose GB lies within the given bounds"""
+        return _range_positions(self.gb_index, min_gb, max_gb)
+
+    def price_group_for_country(self, country_code: str) -> Optional[str]:
+        country = self.countries_by_code.get(country_code)
+        return country.get("Price_group") if country else None
+
+    def product_json(self, position: int) -> bytes:
+        """Encoded JSON of one product, sliced from the rendered products body when possible"""
+        if self.product_offsets is None:
+            return render_json(self.products[position])
+        start = len(b'{"products":')
+        return bytes(self.products_body.identity[start + self.product_offsets[position]:start + self.product_offsets[position + 1] - 1])
+
+    def cached(self, key: tuple, build):
+        """Value for key from the per-snapshot LRU of encoded variants, built on a miss"""
+        value = self.projections.get(key)
+        if value is not None:
+            self.projections.move_to_end(key)
+            return value
+        value = build()
+        self.projections[key] = value
+        if len(self.projections) > PROJECTION_CACHE_SIZE:
+            self.projections.popitem(last=False)
+        return value
+
+    def projection(self, section: str, fields: Optional[tuple] = None, drop_nulls: bool = False) -> Projection:
+        """Encoded projection of "products" or "countries", cached per snapshot"""
+        def build():
+            offsets = getattr(self, "product_offsets" if section == "products" else "country_offsets")
+            if fields is None and not drop_nulls and offsets is not None:
+                # The whole record is wanted: page through the already rendered body
+                body = getattr(self, f"{section}_body").identity
+                start = len(f'{{"{section}":'.encode())
+                return Projection(bytes(body[start:start + offsets[-1]]), offsets)
+            return Projection.render(getattr(self, section), fields, drop_nulls)
+        return self.cached((section, fields, drop_nulls), build)
+
+    def offers_body(self, price_group: str) -> EncodedBody:
+        """
+        Rendered offers of a price group: its products with their resolved price.
+
+        Built from the resolved group prices on first use and kept for the
+        lifetime of the snapshot; every country in the group shares it.
+        """
+        body = self.offers_bodies.get(price_group)
+        if body is None:
+            # A country without a price group is offered nothing, as in /api/products/filter
+            positions, prices, tiers = self.group_prices.get(price_group, ((), (), ())) if price_group is not None else ((), (), ())
+            offers = []
+            for position, price, tier in zip(positions, prices, tiers):
+                product = self.product_json(position)
+                resolved = b'"price_usd":' + (render_json(price) if tier >= 0 else b"null") \
+                    + b',"price_tier":' + (render_json(PRICE_TIERS[tier]) if tier >= 0 else b"null")
+                offers.append(product[:-1] + (b"," if len(product) > 2 else b"") + resolved + b"}")
+            tier = price_tier_index(price_group)
+            body = EncodedBody(
+                b'{"price_group":' + render_json(price_group)
+                + b',"price_tier":' + render_json(PRICE_TIERS[tier] if tier is not None else None)
+                + b',"offers":[' + b",".join(offers) + b'],"last_updated":' + render_json(self.last_updated) + b"}"
+            )
+            self.offers_bodies[price_group] = body
+        return body
+
+# Query planning for /api/products/filter
+class QueryPredicate:
+    """One filter condition with an index access path and a per-product check"""
+    __slots__ = ("label", "estimate", "positions", "matches")
+
+    def __init__(self, label: str, estimate: int, positions, matches):
+        self.label = label
+        self.estimate = estimate
+        self.positions = positions  # callable returning candidate positions from an index
+        self.matches = matches  # callable checking a single position
+
+def _posting_predicate(snapshot: CatalogSnapshot, label: str, index: Dict[str, tuple], field: str, value: str) -> QueryPredicate:
+    postings = index.get(value, ())
+    products = snapshot.products
+    return QueryPredicate(
+        label,
+        len(postings),
+        lambda: postings,
+        lambda position: products[position].get(field) == value,
+    )
+
+def _range_predicate(label: str, range_index: tuple, column: tuple, low, high) -> QueryPredicate:
+    start, end = _range_bounds(range_index, low, high)
+    low = float("-inf") if low is None else low
+    high = float("inf") if high is None else high
+
+    def matches(position):
+        value = column[position]
+        return value is not None and low <= value <= high
+
+    return QueryPredicate(label, end - start, lambda: range_index[1][start:end], matches)
+
+def _range_label(name: str, low, high) -> str:
+    return f"{name}[{'' if low is None else low}..{'' if high is None else high}]"
+
+class ProductQuery:
+    """
+    Planned product filter over a catalog snapshot.
+
+    Every filter becomes a predicate with an estimated result size taken from
+    its posting list or range index. The most selective predicate drives the
+    scan from its index and the rest are checked against those candidates in
+    order of increasing estimate, so no step touches more than the driving
+    candidate set.
+    """
+
+    def __init__(self, snapshot: CatalogSnapshot, country_code: Optional[str] = None,
+                 price_group: Optional[str] = None, min_days: Optional[int] = None,
+                 max_days: Optional[int] = None, min_gb: Optional[float] = None,
+                 max_gb: Optional[float] = None, provider_id: Optional[str] = None):
+        self.snapshot = snapshot
+        self.predicates: List[QueryPredicate] = []
+        self.steps: List[str] = []
+
+        if country_code:
+            target_price_group = snapshot.price_group_for_country(country_code)
+            # A country without a price group matches nothing
+            self.predicates.append(_posting_predicate(
+                snapshot, f"country_code={country_code}->price_group={target_price_group}",
+                snapshot.products_by_price_group, "Price_group", target_price_group,
+            ))
+        if price_group:
+            self.predicates.append(_posting_predicate(
+                snapshot, f"price_group={price_group}",
+                snapshot.products_by_price_group, "Price_group", price_group,
+            ))
+        if provider_id:
+            self.predicates.append(_posting_predicate(
+                snapshot, f"provider_id={provider_id}",
+                snapshot.products_by_provider, "Provider_id", provider_id,
+            ))
+        if min_days is not None or max_days is not None:
+            self.predicates.append(_range_predicate(
+                _range_label("days", min_days, max_days), snapshot.days_index, snapshot.days, min_days, max_days,
+            ))
+        if min_gb is not None or max_gb is not None:
+            self.predicates.append(_range_predicate(
+                _range_label("gb", min_gb, max_gb), snapshot.gb_index, snapshot.gb, min_gb, max_gb,
+            ))
+
+        # Cheapest access path first
+        self.predicates.sort(key=lambda predicate: predicate.estimate)
+
+    def positions(self) -> List[int]:
+        """Execute the plan and return matching positions in catalog order"""
+        if not self.predicates:
+            self.steps = [f"scan({len(self.snapshot.products)})"]
+            return list(range(len(self.snapshot.products)))
+        return sorted(self._candidates())
+
+    def top(self, sort: Optional[str] = None, limit: Optional[int] = None, after: Optional[int] = None):
+        """
+        Execute the plan and return one page of matching positions.
+
+        Results are ordered by the snapshot's precomputed ordering for sort
+        (catalog order when None) and start after rank `after`. Returns the
+        positions and the rank of the last one if more results follow.
+        """
+        count = len(self.snapshot.products)
+        order, rank = self.snapshot.orderings[sort] if sort else (None, None)
+        start = 0 if after is None else after + 1
+
+        if not self.predicates:
+            # Walk the precomputed ordering directly: no sort at all
+            end = count if limit is None else min(count, start + limit)
+            self.steps = [f"ordered_scan:{sort or 'catalog'}({start}..{end})"]
+            page = list(order[start:end]) if order is not None else list(range(start, end))
+            return page, (end - 1 if end < count and page else None)
+
+        candidates = self._candidates()
+        if start:
+            candidates = [position for position in candidates if (rank[position] if rank is not None else position) >= start]
+        key = rank.__getitem__ if rank is not None else None
+        if limit is None or len(candidates) <= limit:
+            page = sorted(candidates, key=key)
+            more = False
+        else:
+            # Bounded heap over the rank array instead of sorting every candidate
+            page = heapq.nsmallest(limit, candidates, key=key)
+            more = True
+        self.steps.append(f"top{'' if limit is None else limit}:{sort or 'catalog'}({len(candidates)}->{len(page)})")
+        last = page[-1] if more else None
+        return page, (None if last is None else rank[last] if rank is not None else last)
+
+    def fingerprint(self, sort: Optional[str] = None) -> str:
+        """Short digest of the filters and sort, tying cursors to the query that issued them"""
+        labels = "|".join(sorted(predicate.label for predicate in self.predicates))
+        return f"{zlib.crc32(f'{labels}|{sort}'.encode()):08x}"
+
+    def _candidates(self) -> List[int]:
+        driver, residuals = self.predicates[0], self.predicates[1:]
+        candidates = driver.positions()
+        self.steps = [f"index:{driver.label}({len(candidates)})"]
+        for predicate in residuals:
+            if not candidates:
+                self.steps.append(f"skip:{predicate.label}")
+                continue
+            matches = predicate.matches
+            candidates = [position for position in candidates if matches(position)]
+            self.steps.append(f"filter:{predicate.label}(est {predicate.estimate}->{len(candidates)})")
+        return candidates
+
+    def explain(self) -> str:
+        return " > ".join(self.steps)
+
+# Opaque pagination cursors, valid for one snapshot (by version token, so not across workers or restarts)
+def encode_cursor(digest: str, fingerprint: str, rank: int) -> str:
+    return base64.urlsafe_b64encode(f"{digest}:{fingerprint}:{rank}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, snapshot: CatalogSnapshot, fingerprint: str) -> int:
+    """Return the rank a cursor continues after, or raise HTTPException if it can't be used"""
+    try:
+        digest, cursor_fingerprint, rank = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        rank = int(rank)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if rank < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_fingerprint != fingerprint:
+        raise HTTPException(status_code=400, detail="Cursor was issued for different filters or sort order")
+    # Bound to the content rather than the version, which is counted per process
+    if digest != snapshot.digest:
+        raise HTTPException(status_code=410, detail="Catalog has changed since this cursor was issued; start again from the first page")
+    return rank
+
+# Change detection between refreshes
+class CatalogDiff:
+    """Keys of products and countries added, removed or modified by a refresh"""
+    __slots__ = (
+        "products_added", "products_removed", "products_modified",
+        "countries_added", "countries_removed", "countries_modified",
+    )
+
+    def __init__(self, products_added=(), products_removed=(), products_modified=(),
+                 countries_added=(), countries_removed=(), countries_modified=()):
+        self.products_added = list(products_added)
+        self.products_removed = list(products_removed)
+        self.products_modified = list(products_modified)
+        self.countries_added = list(countries_added)
+        self.countries_removed = list(countries_removed)
+        self.countries_modified = list(countries_modified)
+
+    @property
+    def is_empty(self) -> bool:
+        return not any(getattr(self, name) for name in self.__slots__)
+
+    def to_dict(self) -> Dict[str, list]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, list]) -> "CatalogDiff":
+        return cls(**{name: data.get(name, ()) for name in cls.__slots__})
+
+    def summary(self) -> str:
+        return (
+            f"products +{len(self.products_added)} -{len(self.products_removed)} ~{len(self.products_modified)}, "
+            f"countries +{len(self.countries_added)} -{len(self.countries_removed)} ~{len(self.countries_modified)}"
+        )
+
+class ChangeFeed:
+    """
+    Bounded history of per-version catalog diffs.
+
+    Holds the diffs of the last CHANGE_FEED_SIZE consecutive versions. A
+    version without a known diff, or a gap in the versions, starts the
+    history over, so any delta it answers is complete. Versions are matched
+    by version token, so a client that synced with another worker or an
+    earlier process gets a full resync rather than a wrong delta. Encoded
+    deltas to the latest version are kept until the next one is recorded.
+    """
+
+    def __init__(self, size: int):
+        self.entries = deque(maxlen=size)  # (version, version token, diff from the version before)
+        self.bodies: Dict[str, bytes] = {}  # since -> encoded response
+
+    def record(self, snapshot: CatalogSnapshot):
+        self.bodies.clear()
+        if self.entries and self.entries[-1][0] != snapshot.version - 1:
+            self.entries.clear()
+        if snapshot.changes is None:
+            self.entries.clear()
+        self.entries.append((snapshot.version, snapshot.version_token, snapshot.changes))
+
+    def delta(self, since: str, snapshot: CatalogSnapshot) -> Optional[Dict[str, Any]]:
+        """
+        Compacted changes from the version token `since` to the snapshot.
+
+        Every product or country touched in between is either upserted with
+        its current record or removed; records added and removed again are
+        left out. None when `since` is not a version in the history.
+        """
+        if not self.entries or self.entries[-1][1] != snapshot.version_token:
+            return None
+        tokens = [token for _, token, _ in self.entries]
+        if since not in tokens:
+            return None
+        diffs = [changes for _, _, changes in self.entries][tokens.index(since) + 1:]
+        return {
+            "products": self._compact(diffs, "products", snapshot.products_by_id),
+            "countries": self._compact(diffs, "countries", snapshot.countries_by_code),
+        }
+
+    def response(self, since: str, snapshot: CatalogSnapshot) -> bytes:
+        """Encoded /api/esim-data/changes body for a client at `since`"""
+        body = self.bodies.get(since)
+        if body is not None and self.entries[-1][1] == snapshot.version_token:
+            return body
+        delta = self.delta(since, snapshot)
+        result = {"since": since, "version": snapshot.version_token, "full_resync": delta is None}
+        if delta is not None:
+            result.update(delta)
+        result["last_updated"] = snapshot.last_updated
+        body = render_json(result)
+        if delta is not None:
+            # Only versions in the history are kept, which bounds this by CHANGE_FEED_SIZE
+            self.bodies[since] = body
+        return body
+
+    @staticmethod
+    def _compact(diffs: List["CatalogDiff"], section: str, current: Dict[str, Any]) -> Dict[str, list]:
+        touched = {}
+        for diff in diffs:
+            for key in getattr(diff, f"{section}_added"):
+                # Keys first seen as added did not exist at `since`
+                touched.setdefault(key, False)
+            for key in getattr(diff, f"{section}_modified") + getattr(diff, f"{section}_removed"):
+                touched.setdefault(key, True)
+        upserted, removed = [], []
+        for key, existed in touched.items():
+            record = current.get(key)
+            if record is not None:
+                upserted.append(record)
+            elif existed:
+                removed.append(key)
+        return {"upserted": upserted, "removed": removed}
+
+QUARANTINE_SAMPLE_LIMIT = 20  # Rejected rows whose problems are kept for diagnostics
+
+class RecordReconciler:
+    """
+    Validate new records and match them to old ones by key, one record at a time.
+
+    Unchanged records are replaced by the old objects, so the new snapshot
+    shares them and can reuse their encoded JSON. Other records are checked
+    against the model once and compacted; rows that fail are quarantined.
+    """
+    __slots__ = ("key", "model", "section", "quarantine", "old_by_key", "records", "added", "modified", "seen")
+
+    def __init__(self, old_records, key: str, model, section: str, quarantine: Dict[str, Any]):
+        self.key = key
+        self.model = model
+        self.section = section
+        self.quarantine = quarantine
+        self.old_by_key = {}
+        for record in old_records:
+            self.old_by_key.setdefault(record.get(key), record)
+        self.records, self.added, self.modified, self.seen = [], {}, {}, set()
+
+    def add(self, record):
+        record_key = record.get(self.key) if isinstance(record, dict) else None
+        old = self.old_by_key.get(record_key)
+        if old is not None and old == record:
+            self.seen.add(record_key)
+            self.records.append(old)
+            return
+        problems = validate_record(self.model, record)
+        if problems:
+            self.quarantine[self.section] += 1
+            if len(self.quarantine["samples"]) < QUARANTINE_SAMPLE_LIMIT:
+                self.quarantine["samples"].append({"section": self.section, "key": str(record_key), "problems": problems})
+            return
+        self.seen.add(record_key)
+        if old is None:
+            self.added[record_key] = None
+        else:
+            self.modified[record_key] = None
+        self.records.append(compact_record(record))
+
+    def finish(self):
+        removed = [record_key for record_key in self.old_by_key if record_key not in self.seen]
+        return self.records, list(self.added), removed, list(self.modified)
+
+class CatalogReconciler:
+    """Validate, compact and diff a fresh catalog against a snapshot by Product_id / Country_Code"""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.quarantine = {"products": 0, "countries": 0, "samples": []}
+        self.sections = {
+            "products": RecordReconciler(snapshot.products, "Product_id", Product, "products", self.quarantine),
+            "countries": RecordReconciler(snapshot.countries, "Country_Code", Country, "countries", self.quarantine),
+        }
+
+    def add(self, section: str, record):
+        self.sections[section].add(record)
+
+    def finish(self):
+        """Returns (products, countries, diff, quarantine)"""
+        products, products_added, products_removed, products_modified = self.sections["products"].finish()
+        countries, countries_added, countries_removed, countries_modified = self.sections["countries"].finish()
+        diff = CatalogDiff(
+            products_added, products_removed, products_modified,
+            countries_added, countries_removed, countries_modified,
+        )
+        return products, countries, diff, self.quarantine
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+class CatalogStreamDecoder:
+    """
+    Incrementally decode a /v1/data body fed in arbitrary byte chunks.
+
+    Elements of the top-level "products" and "countries" arrays are decoded
+    one at a time and handed to on_record(section, record) as soon as they
+    are complete; other top-level values are decoded and dropped. Only the
+    undecoded tail of the stream is buffered.
+    """
+    SECTIONS = ("products", "countries")
+
+    def __init__(self, on_record):
+        self.on_record = on_record
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.state = "start"
+        self.section = None
+        self.closed = False
+
+    def feed(self, chunk: bytes):
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(chunk)
+        self.pos = 0
+        self._scan()
+
+    def close(self):
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b"", final=True)
+        self.pos = 0
+        self.closed = True
+        self._scan()
+        if self.state != "end" or self.buffer[self.pos:].strip():
+            raise ValueError(f"Truncated or malformed catalog payload (stopped in state '{self.state}')")
+
+    def _next_char(self) -> Optional[str]:
+        self.pos = _JSON_WHITESPACE.match(self.buffer, self.pos).end()
+        return self.buffer[self.pos] if self.pos < len(self.buffer) else None
+
+    def _decode_value(self):
+        """Decode one complete value at pos, or return (False, None) until more input arrives"""
+        try:
+            value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if self.closed:
+                raise
+            return False, None
+        if not self.closed:
+            # A number or literal may continue in the next chunk: only accept a
+            # value once the delimiter that follows it has arrived
+            following = _JSON_WHITESPACE.match(self.buffer, end).end()
+            if following == len(self.buffer) or self.buffer[following] not in ",:]}":
+                return False, None
+        self.pos = end
+        return True, value
+
+    def _expect(self, char: str):
+        raise ValueError(f"Malformed catalog payload: expected {char} at offset {self.pos}")
+
+    def _scan(self):
+        while True:
+            char = self._next_char()
+            if char is None or self.state == "end":
+                return
+            if self.state == "start":
+                if char != "{":
+                    self._expect("'{'")
+                self.pos += 1
+                self.state = "key"
+            elif self.state in ("key", "next_key"):
+                if char == "}":
+                    self.pos += 1
+                    self.state = "end"
+                    continue
+                if self.state == "next_key":
+                    if char != ",":
+                        self._expect("',' or '}'")
+                    self.pos += 1
+                    self.state = "key"
+                    continue
+                complete, key = self._decode_value()
+                if not complete:
+                    return
+                if not isinstance(key, str):
+                    self._expect("an object key")
+                self.section = key
+                self.state = "colon"
+            elif self.state == "colon":
+                if char != ":":
+                    self._expect("':'")
+                self.pos += 1
+                self.state = "value"
+            elif self.state == "value":
+                if char == "[" and self.section in self.SECTIONS:
+                    self.pos += 1
+                    self.state = "first_element"
+                    continue
+                complete, _ = self._decode_value()
+                if not complete:
+                    return
+                self.state = "next_key"
+            elif self.state in ("first_element", "element", "next_element"):
+                if char == "]" and self.state != "element":
+                    self.pos += 1
+                    self.state = "next_key"
+                    continue
+                if self.state == "next_element":
+                    if char != ",":
+                        self._expect("',' or ']'")
+                    self.pos += 1
+                    self.state = "element"
+                    continue
+                complete, record = self._decode_value()
+                if not complete:
+                    return
+                self.on_record(self.section, record)
+                self.state = "next_element"
+
+class CatalogIngest:
+    """Hash, decode and reconcile a streamed /v1/data body against the current snapshot"""
+
+    def __init__(self, current: CatalogSnapshot):
+        self.current = current
+        self.digest = hashlib.sha256()
+        self.reconciler = CatalogReconciler(current)
+        self.decoder = CatalogStreamDecoder(self.reconciler.add)
+
+    def feed(self, chunk: bytes):
+        self.digest.update(chunk)
+        self.decoder.feed(chunk)
+
+    def finish(self):
+        """Returns (products, countries, diff, quarantine, content_hash)"""
+        self.decoder.close()
+        return (*self.reconciler.finish(), self.digest.hexdigest())
+
+# On-disk snapshot format
+SNAPSHOT_FILE_MAGIC = b"ESIMCAT1"
+
+def write_snapshot_file(path: str, snapshot: CatalogSnapshot, durable: bool = False):
+    """
+    Atomically write a snapshot's rendered bodies to a file.
+
+    Layout: magic, u32 header length, JSON header with the snapshot metadata
+    and a section table, then the raw sections. Products and countries are
+    recovered from their rendered bodies, so nothing is stored twice.
+    """
+    sections = [("products_body", snapshot.products_body.identity), ("countries_body", snapshot.countries_body.identity)]
+    for name in ("products_body", "countries_body"):
+        for encoding, variant in getattr(snapshot, name).variants.items():
+            sections.append((f"{name}.{encoding}", variant))
+    esim_data = snapshot.esim_data_body
+    sections += [("esim_data.head", esim_data.head), ("esim_data.tail", esim_data.tail), ("esim_data.gzip_head", esim_data.gzip_head)]
+
+    table, offset = {}, 0
+    for name, data in sections:
+        table[name] = [offset, len(data)]
+        offset += len(data)
+    header = render_json({
+        "version": snapshot.version,
+        "last_updated": snapshot.last_updated,
+        "etag": snapshot.etag,
+        "esim_data_head_crc": esim_data.head_crc,
+        "source_validators": snapshot.source_validators,
+        "quarantine": snapshot.quarantine,
+        "changes": snapshot.changes.to_dict() if snapshot.changes is not None else None,
+        "sections": table,
+    })
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(SNAPSHOT_FILE_MAGIC + struct.pack("<I", len(header)) + header)
+        for _, data in sections:
+            snapshot_file.write(data)
+        if durable:
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+def read_snapshot_file(path: str) -> CatalogSnapshot:
+    """
+    Load a snapshot written by write_snapshot_file.
+
+    The file is memory-mapped read-only and the rendered bodies are served as
+    views into the mapping, so processes loading the same file share those
+    pages instead of holding private copies.
+    """
+    with open(path, "rb") as snapshot_file:
+        mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(SNAPSHOT_FILE_MAGIC)] != SNAPSHOT_FILE_MAGIC:
+        raise ValueError(f"{path} is not a catalog snapshot file")
+    header_start = len(SNAPSHOT_FILE_MAGIC) + 4
+    (header_length,) = struct.unpack_from("<I", mapped, len(SNAPSHOT_FILE_MAGIC))
+    header = json.loads(bytes(view[header_start:header_start + header_length]))
+    base = header_start + header_length
+    sections = {name: view[base + offset:base + offset + length] for name, (offset, length) in header["sections"].items()}
+
+    def encoded(name: str) -> EncodedBody:
+        prefix = f"{name}."
+        variants = {key[len(prefix):]: data for key, data in sections.items() if key.startswith(prefix)}
+        return EncodedBody(sections[name], variants)
+
+    rendered = {
+        "products_body": encoded("products_body"),
+        "countries_body": encoded("countries_body"),
+        "esim_data_body": TimestampedBody(
+            sections["esim_data.head"], sections["esim_data.tail"],
+            sections["esim_data.gzip_head"], header["esim_data_head_crc"],
+        ),
+        "etag": header["etag"],
+    }
+    products = json.loads(bytes(sections["products_body"]))["products"]
+    countries = json.loads(bytes(sections["countries_body"]))["countries"]
+    return CatalogSnapshot(
+        header["version"], products, countries, header["last_updated"],
+        rendered=rendered, source_validators=header.get("source_validators"),
+        quarantine=header.get("quarantine"),
+        changes=CatalogDiff.from_dict(header["changes"]) if header.get("changes") is not None else None,
+    )
+
+# Shared upstream HTTP clients
+class UpstreamClients:
+    """
+    Application-lifetime httpx clients, one keep-alive pool per upstream.
+
+    Clients are created lazily on first use, so each gunicorn worker opens its
+    own pool after forking, and are closed by the shutdown hook.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+
+upstream_clients = UpstreamClients()
+
 # Data storage
 class ESIMData:
     def __init__(self):
-        self.products = []
-        self.countries = []
-        self.last_updated = None
-        self.is_updating = False
+        self.snapshot = CatalogSnapshot(0, (), (), None)
+        self.refresh_task: Optional[asyncio.Future] = None
+        self.preloaded = False  # built in the gunicorn master before fork
+        self._revalidated = (None, {})
+        self.changes = ChangeFeed(CHANGE_FEED_SIZE)
         
         # Initialize with sample data if enabled
         if USE_SAMPLE_DATA:
             print("Initializing with sample data for development")
-            self.products = SAMPLE_PRODUCTS
-            self.countries = SAMPLE_COUNTRIES
-            self.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.publish(SAMPLE_PRODUCTS, SAMPLE_COUNTRIES)
+
+    def build(self, products, countries, source_validators: Optional[Dict[str, Optional[str]]] = None,
+              previous: Optional[CatalogSnapshot] = None, quarantine: Optional[Dict[str, Any]] = None,
+              changes: Optional[CatalogDiff] = None) -> CatalogSnapshot:
+        """Build the next catalog snapshot without installing it; safe to call off the event loop"""
+        previous = previous or self.snapshot
+        return CatalogSnapshot(
+            previous.version + 1,
+            products or [],
+            countries or [],
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            previous=previous,
+            source_validators=source_validators,
+            quarantine=quarantine,
+            changes=changes,
+        )
+
+    def publish(self, products, countries, source_validators: Optional[Dict[str, Optional[str]]] = None) -> CatalogSnapshot:
+        """Build a new catalog snapshot and swap it in atomically"""
+        snapshot = self.build(products, countries, source_validators)
+        if shared_catalog.is_leader:
+            shared_catalog.publish(snapshot)
+        self.install(snapshot)
+        return snapshot
+
+    def install(self, snapshot: CatalogSnapshot):
+        """Swap in an already built snapshot"""
+        self.snapshot = snapshot
+        self.changes.record(snapshot)
+
+    def revalidate(self, snapshot: CatalogSnapshot, source_validators: Dict[str, Optional[str]]):
+        """Record newer WordPress validators for a snapshot whose content did not change"""
+        self._revalidated = (snapshot.version, source_validators)
+
+    def source_validators(self) -> Dict[str, Optional[str]]:
+        """Validators of the WordPress response behind the current snapshot"""
+        version, validators = self._revalidated
+        if version == self.snapshot.version:
+            return validators
+        return self.snapshot.source_validators or {}
+
+    @property
+    def is_updating(self) -> bool:
+        return self.refresh_task is not None and not self.refresh_task.done()
+
+    # Read-only views of the current snapshot
+    @property
+    def products(self):
+        return self.snapshot.products
+
+    @property
+    def countries(self):
+        return self.snapshot.countries
+
+    @property
+    def last_updated(self):
+        return self.snapshot.last_updated
+
+# Catalog sharing between workers on one host
+class SharedCatalog:
+    """
+    Single refresher per host with the catalog shared through a mapped file.
+
+    The worker holding an exclusive lock on SHARED_CATALOG_DIR/refresher.lock
+    is the only one that polls WordPress. Each snapshot it publishes is
+    written to catalog.bin and its version is stored in the memory-mapped
+    generation file. The other workers poll that generation, map new
+    catalog.bin versions read-only and serve their bodies from the mapping.
+    When the leader exits its lock is released and another worker takes over.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.enabled = bool(directory) and fcntl is not None
+        self.is_leader = False
+        self._lock_file = None
+        self._generation = None
+        self._loading = None  # read of catalog.bin running on the build executor
+
+    @property
+    def is_follower(self) -> bool:
+        return self.enabled and not self.is_leader
+
+    @property
+    def catalog_path(self) -> str:
+        return os.path.join(self.directory, "catalog.bin")
+
+    def open(self):
+        """Map the generation counter; called in each worker after fork"""
+        if not self.enabled or self._generation is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, "catalog.gen"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+            self._generation = mmap.mmap(fd, 8)
+        finally:
+            os.close(fd)
+
+    def generation(self) -> int:
+        return struct.unpack_from("<Q", self._generation)[0] if self._generation is not None else 0
+
+    async def try_lead(self) -> bool:
+        """Try to become the refresher for this host"""
+        if not self.enabled or self.is_leader:
+            return self.is_leader
+        lock_file = open(os.path.join(self.directory, "refresher.lock"), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        # Continue from the latest shared version so versions stay monotonic
+        await self.sync()
+        self.is_leader = True
+        print(f"Worker {os.getpid()} is the catalog refresher for this host")
+        return True
+
+    def publish(self, snapshot: CatalogSnapshot):
+        try:
+            write_snapshot_file(self.catalog_path, snapshot)
+            struct.pack_into("<Q", self._generation, 0, snapshot.version)
+        except Exception as e:
+            print(f"Error publishing shared catalog: {str(e)}")
+
+    async def sync(self) -> bool:
+        """
+        Install the shared snapshot if it is newer than ours.
+
+        The file is read and the snapshot built (records, indexes, orderings)
+        on the build executor like a refresh; only the install runs on the loop.
+        """
+        if self.generation() <= data_store.snapshot.version:
+            return False
+        if self._loading is None or self._loading.done():
+            loop = asyncio.get_running_loop()
+            self._loading = loop.run_in_executor(catalog_build_executor, read_snapshot_file, self.catalog_path)
+        try:
+            # Concurrent callers share one load
+            snapshot = await asyncio.shield(self._loading)
+        except (OSError, ValueError) as e:
+            print(f"Error loading shared catalog: {str(e)}")
+            return False
+        if snapshot.version <= data_store.snapshot.version:
+            return False
+        data_store.install(snapshot)
+        if DEBUG_MODE:
+            print(f"Worker {os.getpid()} loaded shared catalog version {snapshot.version}")
+        return True
+
+    async def wait_for_update(self):
+        """Follower side of a refresh: wait for the leader's next publish"""
+        deadline = time.monotonic() + CATALOG_WAIT_TIMEOUT
+        while not await self.sync() and time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+
+shared_catalog = SharedCatalog(SHARED_CATALOG_DIR)
 
 # Global data store
 data_store = ESIMData()
@@ -103,6 +1588,32 @@ class Product(BaseModel):
     extra_field2: Optional[str] = None
     extra_field3: Optional[str] = None
 
+    # Numeric columns are parsed once per snapshot, so rows they can't be parsed from are rejected
+    @field_validator("Days", mode="before")
+    @classmethod
+    def days_must_parse(cls, value):
+        if parse_days(value) is None:
+            raise ValueError("must be a whole number of days")
+        return value
+
+    @field_validator("GB", mode="before")
+    @classmethod
+    def gb_must_parse(cls, value):
+        try:
+            gb = gb_value(value)
+        except ValueError:
+            gb = math.nan
+        if value is None or not math.isfinite(gb):
+            raise ValueError("must be a number of GB, like '5GB'")
+        return value
+
+    @field_validator("Price_USD_5", "Price_USD_10", "Price_USD_15", "Price_USD_20", "Price_USD_25", mode="before")
+    @classmethod
+    def price_must_parse(cls, value):
+        if value is not None and value != "" and math.isnan(parse_price(value)):
+            raise ValueError("must be a price in USD")
+        return value
+
 class Country(BaseModel):
     Country_Code: str
     Country_Region: str
@@ -141,231 +1652,535 @@ async def get_api_key(api_key: str = Security(api_key_header)):
         )
     return api_key
 
-# Helper function to parse GB value to float 
-def parse_gb(gb_str: str) -> float:
-    """Parse GB string (like '5GB') to float value"""
-    if not gb_str:
-        return 0.0
+
+async def fetch_wordpress_data() -> CatalogSnapshot:
+    """
+    Refresh the catalog from WordPress, coalescing concurrent callers.
+
+    Only one refresh runs at a time. Callers that arrive while it is in flight
+    await the same task, for at most CATALOG_WAIT_TIMEOUT seconds, and all get
+    the snapshot it produced (or the current one if the wait runs out).
+    """
+    refresh = data_store.refresh_task
+    if refresh is None or refresh.done():
+        # Workers that share the catalog wait for the refresher instead of calling WordPress
+        if shared_catalog.is_follower:
+            refresh = asyncio.ensure_future(shared_catalog.wait_for_update())
+        else:
+            refresh = asyncio.ensure_future(refresh_wordpress_data())
+        data_store.refresh_task = refresh
+    
     try:
-        return float(gb_str.replace('GB', '').replace('gb', '').strip())
-    except ValueError:
-        return 0.0
+        # Shielded so a caller that times out or disconnects does not cancel the refresh
+        await asyncio.wait_for(asyncio.shield(refresh), timeout=CATALOG_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Catalog refresh still running after {CATALOG_WAIT_TIMEOUT}s, serving current data")
+    except Exception as e:
+        print(f"Catalog refresh failed: {str(e)}")
+    return data_store.snapshot
 
-async def fetch_wordpress_data():
+async def refresh_wordpress_data():
     """Fetch data from WordPress REST API"""
-    if data_store.is_updating:
-        return
-    
-    data_store.is_updating = True
-    
     try:
         # For development/testing - skip actual API call if using sample data
         if USE_SAMPLE_DATA:
             print("Using sample data - skipping WordPress API call")
             if not data_store.last_updated:
-                data_store.products = SAMPLE_PRODUCTS
-                data_store.countries = SAMPLE_COUNTRIES
-                data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            data_store.is_updating = False
+                data_store.publish(SAMPLE_PRODUCTS, SAMPLE_COUNTRIES)
             return
 
-        async with httpx.AsyncClient() as client:
-            # Set up authentication headers
-            headers = {}
+        client = upstream_clients.get("wordpress")
+        # Set up authentication headers
+        headers = dict(WORDPRESS_AUTH_HEADERS)
+        
+        # Try the test endpoint first if enabled
+        if os.getenv("WORDPRESS_TEST_ENDPOINT", "false").lower() == "true":
+            test_url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/test"
+            if DEBUG_MODE:
+                print(f"Testing API connectivity with: {test_url}")
             
-            # Use app password authentication if configured
-            if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD:
-                # Remove spaces from app password if present
-                app_password = WORDPRESS_APP_PASSWORD.replace(" ", "")
-                import base64
-                auth_string = f"{WORDPRESS_APP_USERNAME}:{app_password}"
-                encoded_auth = base64.b64encode(auth_string.encode()).decode()
-                headers["Authorization"] = f"Basic {encoded_auth}"
-                if DEBUG_MODE:
-                    print(f"Using WordPress app password authentication for user: {WORDPRESS_APP_USERNAME}")
-            # Fall back to API key if configured
-            elif API_KEY:
-                headers["Authorization"] = f"Bearer {API_KEY}"
-                if DEBUG_MODE:
-                    print("Using API key authentication")
+            try:
+                test_response = await client.get(test_url, headers=headers, timeout=10.0)
+                if test_response.status_code == 200:
+                    print(f"Test endpoint successful: {test_response.text}")
+                else:
+                    print(f"Test endpoint failed with status {test_response.status_code}: {test_response.text}")
+                    print("Plugin may not be registered properly or REST API could be disabled")
+            except Exception as e:
+                print(f"Error connecting to test endpoint: {str(e)}")
+        
+        # Now try the actual data endpoint
+        url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/data"
+        if DEBUG_MODE:
+            print(f"Attempting to connect to: {url}")
+        
+        # Ask WordPress to skip the body when nothing changed since our snapshot
+        current = data_store.snapshot
+        source = data_store.source_validators()
+        if source.get("etag"):
+            headers["If-None-Match"] = source["etag"]
+        if source.get("last_modified"):
+            headers["If-Modified-Since"] = source["last_modified"]
+        
+        try:
+            # Parse, index, render and compress happen on the build thread; the loop only swaps in
+            response, outcome = await fetch_catalog_payload(client, url, headers, current, source)
             
-            # Try the test endpoint first if enabled
-            if os.getenv("WORDPRESS_TEST_ENDPOINT", "false").lower() == "true":
-                test_url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/test"
+            if response.status_code == 304 and current.products:
                 if DEBUG_MODE:
-                    print(f"Testing API connectivity with: {test_url}")
+                    print(f"Catalog not modified since version {current.version}")
+            elif response.status_code == 200:
+                snapshot, validators, diff = outcome
+                if snapshot is None:
+                    data_store.revalidate(current, validators)
+                    if DEBUG_MODE:
+                        print(f"Catalog content unchanged since version {current.version}")
+                else:
+                    data_store.install(snapshot)
+                    print(f"Data updated at {snapshot.last_updated} (catalog version {snapshot.version}: {diff.summary()})")
+            elif response.status_code == 404 and "rest_no_route" in response.text:
+                print("ERROR: WordPress REST API endpoint not found (rest_no_route)")
+                print("The eSIM Global plugin endpoint is not registered. Please check:")
+                print("1. The plugin is activated in WordPress")
+                print("2. Permalinks are updated (visit Settings > Permalinks and save)")
+                print("3. The REST API is not disabled by security plugins")
                 
-                try:
-                    test_response = await client.get(test_url, headers=headers, timeout=10.0)
-                    if test_response.status_code == 200:
-                        print(f"Test endpoint successful: {test_response.text}")
-                    else:
-                        print(f"Test endpoint failed with status {test_response.status_code}: {test_response.text}")
-                        print("Plugin may not be registered properly or REST API could be disabled")
-                except Exception as e:
-                    print(f"Error connecting to test endpoint: {str(e)}")
-            
-            # Now try the actual data endpoint
-            url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/data"
-            if DEBUG_MODE:
-                print(f"Attempting to connect to: {url}")
-            
+                # Keep the last known good catalog, or use sample data if allowed
+                fall_back_to_last_known_good("due to missing REST API endpoint")
+            else:
+                print(f"Error fetching data: HTTP {response.status_code} - {response.text}")
+                # Keep the last known good catalog, or use sample data if allowed
+                fall_back_to_last_known_good()
+        except httpx.ConnectError as e:
+            print(f"Connection error: Could not connect to {url}")
+            print(f"Details: {str(e)}")
+            # Try to determine if the WordPress site is reachable
             try:
-                response = await client.get(url, headers=headers, timeout=30.0)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    data_store.products = data.get("products", [])
-                    data_store.countries = data.get("countries", [])
-                    data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"Data updated at {data_store.last_updated}")
-                elif response.status_code == 404 and "rest_no_route" in response.text:
-                    print("ERROR: WordPress REST API endpoint not found (rest_no_route)")
-                    print("The eSIM Global plugin endpoint is not registered. Please check:")
-                    print("1. The plugin is activated in WordPress")
-                    print("2. Permalinks are updated (visit Settings > Permalinks and save)")
-                    print("3. The REST API is not disabled by security plugins")
-                    
-                    # If fallback enabled, use sample data
-                    if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
-                        print("Using sample data as fallback due to missing REST API endpoint")
-                        data_store.products = SAMPLE_PRODUCTS
-                        data_store.countries = SAMPLE_COUNTRIES
-                        data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                # Try to connect to the base URL
+                base_url = WORDPRESS_URL.split('/wp-json')[0]
+                print(f"Checking if WordPress site is reachable at: {base_url}")
+                test_response = await client.get(base_url, timeout=10.0)
+                if test_response.status_code < 400:
+                    print(f"WordPress site is reachable (status {test_response.status_code}), but the REST API endpoint may not be available.")
+                    print("Check if the REST API is enabled in WordPress and the eSIM Global plugin is activated.")
+                    # Try accessing the default REST API endpoint
+                    try:
+                        wp_api_response = await client.get(f"{WORDPRESS_URL}/wp-json", timeout=10.0)
+                        if wp_api_response.status_code < 400:
+                            print("WordPress REST API is working, but the eSIM Global plugin endpoint is not available.")
+                            print("Check if the plugin is activated and properly registering its REST routes.")
+                        else:
+                            print(f"WordPress REST API is not accessible (status {wp_api_response.status_code})")
+                            print("Check WordPress settings and if any security plugins are blocking the REST API.")
+                    except Exception as wp_api_e:
+                        print(f"Error accessing WordPress REST API: {str(wp_api_e)}")
                 else:
-                    print(f"Error fetching data: HTTP {response.status_code} - {response.text}")
-                    # If we get an error but sample data is allowed as fallback
-                    if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
-                        print("Using sample data as fallback")
-                        data_store.products = SAMPLE_PRODUCTS
-                        data_store.countries = SAMPLE_COUNTRIES
-                        data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            except httpx.ConnectError as e:
-                print(f"Connection error: Could not connect to {url}")
-                print(f"Details: {str(e)}")
-                # Try to determine if the WordPress site is reachable
-                try:
-                    # Try to connect to the base URL
-                    base_url = WORDPRESS_URL.split('/wp-json')[0]
-                    print(f"Checking if WordPress site is reachable at: {base_url}")
-                    test_response = await client.get(base_url, timeout=10.0)
-                    if test_response.status_code < 400:
-                        print(f"WordPress site is reachable (status {test_response.status_code}), but the REST API endpoint may not be available.")
-                        print("Check if the REST API is enabled in WordPress and the eSIM Global plugin is activated.")
-                        # Try accessing the default REST API endpoint
-                        try:
-                            wp_api_response = await client.get(f"{WORDPRESS_URL}/wp-json", timeout=10.0)
-                            if wp_api_response.status_code < 400:
-                                print("WordPress REST API is working, but the eSIM Global plugin endpoint is not available.")
-                                print("Check if the plugin is activated and properly registering its REST routes.")
-                            else:
-                                print(f"WordPress REST API is not accessible (status {wp_api_response.status_code})")
-                                print("Check WordPress settings and if any security plugins are blocking the REST API.")
-                        except Exception as wp_api_e:
-                            print(f"Error accessing WordPress REST API: {str(wp_api_e)}")
-                    else:
-                        print(f"WordPress site returned error status: {test_response.status_code}")
-                except Exception as base_e:
-                    print(f"WordPress site is not reachable: {str(base_e)}")
-                    print("Please check your WORDPRESS_URL setting and ensure the WordPress site is running.")
-                
-                # Use sample data if fallback is enabled
-                if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
-                    print("Using sample data as fallback due to connection error")
-                    data_store.products = SAMPLE_PRODUCTS
-                    data_store.countries = SAMPLE_COUNTRIES
-                    data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-            except httpx.TimeoutException:
-                print(f"Timeout connecting to {url} - WordPress site may be slow to respond")
-                # Use sample data if fallback is enabled
-                if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
-                    print("Using sample data as fallback due to connection timeout")
-                    data_store.products = SAMPLE_PRODUCTS
-                    data_store.countries = SAMPLE_COUNTRIES
-                    data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            except Exception as e:
-                print(f"Error connecting to WordPress: {str(e)}")
-                # Use sample data if fallback is enabled
-                if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
-                    print("Using sample data as fallback due to general error")
-                    data_store.products = SAMPLE_PRODUCTS
-                    data_store.countries = SAMPLE_COUNTRIES
-                    data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"WordPress site returned error status: {test_response.status_code}")
+            except Exception as base_e:
+                print(f"WordPress site is not reachable: {str(base_e)}")
+                print("Please check your WORDPRESS_URL setting and ensure the WordPress site is running.")
+            
+            # Keep the last known good catalog, or use sample data if allowed
+            fall_back_to_last_known_good("due to connection error")
+            
+        except httpx.TimeoutException:
+            print(f"Timeout connecting to {url} - WordPress site may be slow to respond")
+            # Keep the last known good catalog, or use sample data if allowed
+            fall_back_to_last_known_good("due to connection timeout")
+        except Exception as e:
+            print(f"Error connecting to WordPress: {str(e)}")
+            # Keep the last known good catalog, or use sample data if allowed
+            fall_back_to_last_known_good("due to general error")
     except Exception as e:
         print(f"General error updating data: {str(e)}")
-        # Use sample data if fallback is enabled
-        if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
-            print("Using sample data as fallback due to general exception")
-            data_store.products = SAMPLE_PRODUCTS
-            data_store.countries = SAMPLE_COUNTRIES
-            data_store.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    finally:
-        data_store.is_updating = False
+        # Keep the last known good catalog, or use sample data if allowed
+        fall_back_to_last_known_good("due to general exception")
+
+def fall_back_to_last_known_good(reason: str = ""):
+    """After a failed refresh keep the current catalog; sample data is only a fallback for having none"""
+    suffix = f" {reason}" if reason else ""
+    if data_store.products:
+        print(f"Keeping catalog version {data_store.snapshot.version} from {data_store.last_updated}{suffix}")
+    elif os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
+        print(f"Using sample data as fallback{suffix}")
+        data_store.publish(SAMPLE_PRODUCTS, SAMPLE_COUNTRIES)
 
-async def background_data_refresh():
+def save_catalog_cache(snapshot: CatalogSnapshot):
+    """Durably write a snapshot built from WordPress data to CATALOG_CACHE_FILE"""
+    try:
+        directory = os.path.dirname(CATALOG_CACHE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_snapshot_file(CATALOG_CACHE_FILE, snapshot, durable=True)
+    except OSError as e:
+        print(f"Error saving catalog cache to {CATALOG_CACHE_FILE}: {str(e)}")
+
+async def load_catalog_cache() -> bool:
+    """
+    Install the last known good snapshot from CATALOG_CACHE_FILE.
+
+    Returns False when there is no usable cache or a catalog is already
+    loaded. Only the rendered bodies are memory-mapped: the records, indexes
+    and orderings are rebuilt from the file (about half a second for 30k
+    products), so this runs on the build executor like a refresh. It spares
+    the wait for WordPress, and a background refresh brings it up to date.
+    """
+    if not CATALOG_CACHE_FILE or USE_SAMPLE_DATA or data_store.products or not os.path.exists(CATALOG_CACHE_FILE):
+        return False
+    try:
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(catalog_build_executor, read_snapshot_file, CATALOG_CACHE_FILE)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable catalog cache {CATALOG_CACHE_FILE}: {str(e)}")
+        return False
+    if data_store.products:
+        # Another catalog (e.g. from the shared directory) was installed meanwhile
+        return False
+    data_store.install(snapshot)
+    if shared_catalog.is_leader:
+        shared_catalog.publish(snapshot)
+    print(f"Loaded catalog version {snapshot.version} from {snapshot.last_updated} out of {CATALOG_CACHE_FILE}")
+    return True
+
+# Refreshes build snapshots on this thread so the event loop keeps serving requests.
+# The thread still shares the GIL with the loop, which only gets it back between
+# bytecodes, so builds avoid long single C calls such as one json.loads of the body.
+catalog_build_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-build")
+
+def build_catalog_from_payload(current: CatalogSnapshot, content: bytes, etag: Optional[str],
+                               last_modified: Optional[str], previous_hash: Optional[str]):
+    """
+    Turn a buffered /v1/data response body into the next snapshot, off the event loop.
+
+    Returns (snapshot, validators, diff); snapshot is None when the payload or
+    its content is unchanged from the current snapshot.
+    """
+    validators = {
+        "etag": etag,
+        "last_modified": last_modified,
+        "content_hash": hashlib.sha256(content).hexdigest(),
+    }
+    if validators["content_hash"] == previous_hash and current.products:
+        # Same payload as last time: no parsing, reindexing or rendering
+        return None, validators, None
+
+    # Decoded record by record: a single json.loads would hold the GIL, and so
+    # stall the event loop, for the whole parse
+    reconciler = CatalogReconciler(current)
+    decoder = CatalogStreamDecoder(reconciler.add)
+    for start in range(0, len(content), CATALOG_STREAM_CHUNK_SIZE):
+        decoder.feed(content[start:start + CATALOG_STREAM_CHUNK_SIZE])
+    decoder.close()
+    products, countries, diff, quarantine = reconciler.finish()
+    return _build_catalog_snapshot(current, products, countries, diff, quarantine, validators)
+
+def build_catalog_from_stream(ingest: CatalogIngest, etag: Optional[str], last_modified: Optional[str]):
+    """Finish a streamed /v1/data ingest into the next snapshot, like build_catalog_from_payload"""
+    products, countries, diff, quarantine, content_hash = ingest.finish()
+    validators = {"etag": etag, "last_modified": last_modified, "content_hash": content_hash}
+    return _build_catalog_snapshot(ingest.current, products, countries, diff, quarantine, validators)
+
+def _build_catalog_snapshot(current: CatalogSnapshot, products, countries, diff: CatalogDiff,
+                            quarantine: Dict[str, Any], validators):
+    """Build and share the next snapshot unless the reconciled content equals the current one"""
+    if diff.is_empty and current.products and len(products) == len(current.products) and len(countries) == len(current.countries) \
+            and all(a is b for a, b in zip(products, current.products)) and all(a is b for a, b in zip(countries, current.countries)):
+        return None, validators, diff
+
+    if quarantine["products"] or quarantine["countries"]:
+        print(f"Quarantined {quarantine['products']} products and {quarantine['countries']} countries that failed validation")
+    snapshot = data_store.build(products, countries, source_validators=validators, previous=current,
+                                quarantine=quarantine, changes=diff)
+    if shared_catalog.is_leader:
+        shared_catalog.publish(snapshot)
+    if CATALOG_CACHE_FILE:
+        save_catalog_cache(snapshot)
+    return snapshot, validators, diff
+
+async def fetch_catalog_payload(client: httpx.AsyncClient, url: str, headers: Dict[str, str],
+                                current: CatalogSnapshot, source: Dict[str, Optional[str]]):
+    """
+    GET /v1/data and, on a 200, build the next snapshot on the build thread.
+
+    Returns (response, outcome) where outcome is build_catalog_from_payload's
+    result for a 200 and None otherwise. With CATALOG_STREAM_INGEST the body
+    is decoded record by record as it arrives instead of being buffered.
+    """
+    loop = asyncio.get_running_loop()
+    if not CATALOG_STREAM_INGEST:
+        response = await client.get(url, headers=headers, timeout=30.0)
+        if response.status_code != 200:
+            return response, None
+        outcome = await loop.run_in_executor(
+            catalog_build_executor,
+            build_catalog_from_payload,
+            current,
+            response.content,
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+            source.get("content_hash"),
+        )
+        return response, outcome
+
+    async with client.stream("GET", url, headers=headers, timeout=30.0) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response, None
+        ingest = CatalogIngest(current)
+        async for chunk in response.aiter_bytes(CATALOG_STREAM_CHUNK_SIZE):
+            await loop.run_in_executor(catalog_build_executor, ingest.feed, chunk)
+        outcome = await loop.run_in_executor(
+            catalog_build_executor,
+            build_catalog_from_stream,
+            ingest,
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+        )
+        return response, outcome
+
+async def background_data_refresh(initial_delay: float = 0):
     """Continuously refresh data in the background"""
+    await asyncio.sleep(initial_delay)
     while True:
         try:
-            await fetch_wordpress_data()
+            # Only the host's refresher polls WordPress when the catalog is shared
+            if not shared_catalog.is_follower:
+                await fetch_wordpress_data()
         except Exception as e:
             print(f"Error in background refresh: {str(e)}")
         await asyncio.sleep(REFRESH_INTERVAL)
 
+async def shared_catalog_sync():
+    """Pick up snapshots published by the refresher, and take over if it exits"""
+    while True:
+        await asyncio.sleep(SHARED_CATALOG_POLL_INTERVAL)
+        try:
+            if shared_catalog.is_follower and not await shared_catalog.try_lead():
+                await shared_catalog.sync()
+        except Exception as e:
+            print(f"Error syncing shared catalog: {str(e)}")
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize data and start background refresh task"""
-    # Fetch data on startup
-    await fetch_wordpress_data()
+    if shared_catalog.enabled:
+        shared_catalog.open()
+        iccid_cache.open(SHARED_CATALOG_DIR)
+        if not await shared_catalog.try_lead():
+            await shared_catalog.sync()
+        asyncio.create_task(shared_catalog_sync())
+    
+    # Fetch data on startup, unless the gunicorn master already built it before forking.
+    # A cached last known good catalog lets the worker serve at once; the refresh below updates it.
+    if data_store.preloaded:
+        asyncio.create_task(background_data_refresh(initial_delay=REFRESH_INTERVAL))
+    else:
+        if (not shared_catalog.is_follower or not data_store.products) and not await load_catalog_cache():
+            await fetch_wordpress_data()
+        
+        # Start background task for continuous data refresh
+        asyncio.create_task(background_data_refresh())
     
-    # Start background task for continuous data refresh
-    asyncio.create_task(background_data_refresh())
+    if iccid_cache.track:
+        asyncio.create_task(iccid_prefetch_loop())
+    
+    print(f"Worker {os.getpid()} ready with catalog version {data_store.snapshot.version}, memory: {process_memory()}")
+
+def preload_catalog():
+    """
+    Build the catalog in the gunicorn master before workers are forked.
+
+    Called from the when_ready server hook when PRELOAD_CATALOG is enabled.
+    Everything allocated so far is moved to the permanent GC generation so
+    the collector in each worker never writes to those pages, which keeps
+    them shared copy-on-write. Workers swap in fresh snapshots as usual once
+    their own refreshes run.
+    """
+    async def load():
+        try:
+            await load_catalog_cache()
+            await refresh_wordpress_data()
+        finally:
+            # Connections must not be inherited by forked workers
+            await upstream_clients.aclose()
+
+    asyncio.run(load())
+    data_store.preloaded = bool(data_store.products)
+    # Threads do not survive fork: give workers an executor that starts its own build thread
+    global catalog_build_executor
+    catalog_build_executor.shutdown(wait=True)
+    catalog_build_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-build")
+    gc.collect()
+    gc.freeze()
+    print(f"Preloaded catalog version {data_store.snapshot.version} in master, memory: {process_memory()}")
+
+# Helper function to report memory use of the current process
+def process_memory() -> Dict[str, int]:
+    """RSS, PSS, shared and private memory in KiB, read from /proc (empty elsewhere)"""
+    memory = {}
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            for line in smaps:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        return memory
+    return {
+        "rss_kb": memory.get("Rss", 0),
+        "pss_kb": memory.get("Pss", 0),
+        "shared_kb": memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0),
+        "private_kb": memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0),
+    }
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled upstream connections and the snapshot build thread"""
+    await upstream_clients.aclose()
+    catalog_build_executor.shutdown(wait=False)
+
+# Helper function for conditional GETs on catalog endpoints
+def catalog_response(request: Request, snapshot: CatalogSnapshot, body) -> Response:
+    """Answer 304 when the client already has this snapshot, else the pre-rendered body"""
+    headers = snapshot.cache_headers()
+    headers["Vary"] = "Accept-Encoding"
+    headers["X-Catalog-Version"] = snapshot.version_token
+    if snapshot.is_not_modified(request):
+        return Response(status_code=304, headers=headers)
+    
+    # Pick a pre-compressed variant instead of compressing per request
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), body.encodings)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return json_bytes_response(body.render(encoding), headers=headers)
+
+# Helper functions for field projection and pagination of catalog lists
+def parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    """Normalize a fields= list so equivalent requests share a cached projection"""
+    if not fields:
+        return None
+    return tuple(sorted({field.strip() for field in fields.split(",") if field.strip()})) or None
+
+def catalog_list_response(request: Request, snapshot: CatalogSnapshot, section: str, fields: Optional[str],
+                          drop_nulls: bool, limit: Optional[int], cursor: Optional[str]) -> Response:
+    """Serve products or countries projected to some fields and/or one page at a time"""
+    projection = snapshot.projection(section, parse_fields(fields), drop_nulls)
+    last_updated = render_json(snapshot.last_updated)
+    if limit is None and cursor is None:
+        body = projection.bodies.get("full")
+        if body is None:
+            body = EncodedBody(f'{{"{section}":'.encode() + projection.json + b',"last_updated":' + last_updated + b"}")
+            projection.bodies["full"] = body
+        return catalog_response(request, snapshot, body)
+    
+    fingerprint = section
+    start = decode_cursor(cursor, snapshot, fingerprint) + 1 if cursor else 0
+    count = len(projection)
+    end = count if limit is None else min(count, start + limit)
+    next_cursor = encode_cursor(snapshot.digest, fingerprint, end - 1) if end < count else None
+    body = f'{{"{section}":'.encode() + projection.slice(start, end) \
+        + b',"last_updated":' + last_updated + b',"next_cursor":' + render_json(next_cursor) + b"}"
+    return catalog_response(request, snapshot, EncodedBody(body, {}))
 
 @app.get("/api/esim-data", response_model=DataResponse)
-async def get_esim_data(api_key: str = Depends(get_api_key)):
+async def get_esim_data(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated product and country fields to return"),
+    drop_nulls: bool = Query(False, description="Omit fields whose value is null"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of records per page, products first"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    api_key: str = Depends(get_api_key)
+):
     """Get the latest eSIM data"""
     if not data_store.products or not data_store.countries:
         await fetch_wordpress_data()
         if not data_store.products or not data_store.countries:
             raise HTTPException(status_code=503, detail="Data not available yet. Please check server logs for connection issues.")
     
-    return {
-        "products": data_store.products,
-        "countries": data_store.countries,
-        "timestamp": int(time.time()),
-        "last_updated": data_store.last_updated
-    }
+    # Pre-rendered body; the response model only documents the shape
+    snapshot = data_store.snapshot
+    paginated = limit is not None or cursor is not None
+    if not fields and not drop_nulls and not paginated:
+        return catalog_response(request, snapshot, snapshot.esim_data_body)
+    
+    projected_fields = parse_fields(fields)
+    products = snapshot.projection("products", projected_fields, drop_nulls)
+    countries = snapshot.projection("countries", projected_fields, drop_nulls)
+    if paginated:
+        # Pages run through the products and then the countries as one sequence
+        fingerprint = "esim_data"
+        start = decode_cursor(cursor, snapshot, fingerprint) + 1 if cursor else 0
+        split, count = len(products), len(products) + len(countries)
+        end = count if limit is None else min(count, start + limit)
+        next_cursor = encode_cursor(snapshot.digest, fingerprint, end - 1) if end < count else None
+        # Pages are built per request, so like other pages they are not compressed
+        body = b'{"products":' + products.slice(min(start, split), min(end, split)) \
+            + b',"countries":' + countries.slice(max(start - split, 0), max(end - split, 0)) \
+            + b',"timestamp":' + str(int(time.time())).encode() + b',"last_updated":' + render_json(snapshot.last_updated) \
+            + b',"next_cursor":' + render_json(next_cursor) + b"}"
+        return catalog_response(request, snapshot, EncodedBody(body, {}))
+    
+    body = products.bodies.get(("esim_data", projected_fields))
+    if body is None:
+        body = TimestampedBody(
+            b'{"products":' + products.json + b',"countries":' + countries.json + b',"timestamp":',
+            b',"last_updated":' + render_json(snapshot.last_updated) + b"}",
+        )
+        products.bodies[("esim_data", projected_fields)] = body
+    return catalog_response(request, snapshot, body)
 
-@app.get("/api/products")
-async def get_products(api_key: str = Depends(get_api_key)):
-    """Get all products"""
+@app.get("/api/esim-data/changes")
+async def get_esim_data_changes(
+    since: str = Query(..., description="X-Catalog-Version of the catalog the client last synced"),
+    api_key: str = Depends(get_api_key)
+):
+    """Get the products and countries changed since a catalog version"""
     if not data_store.products:
         await fetch_wordpress_data()
     
-    return {"products": data_store.products, "last_updated": data_store.last_updated}
+    snapshot = data_store.snapshot
+    body = data_store.changes.response(since, snapshot)
+    return json_bytes_response(body, headers={"X-Catalog-Version": snapshot.version_token, "Cache-Control": "no-cache"})
 
-@app.get("/api/countries")
-async def get_countries(api_key: str = Depends(get_api_key)):
-    """Get all countries"""
-    if not data_store.countries:
+@app.get("/api/products")
+async def get_products(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated product fields to return"),
+    drop_nulls: bool = Query(False, description="Omit fields whose value is null"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of products to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    api_key: str = Depends(get_api_key)
+):
+    """Get all products, optionally projected and paginated"""
+    if not data_store.products:
         await fetch_wordpress_data()
     
-    return {"countries": data_store.countries, "last_updated": data_store.last_updated}
+    snapshot = data_store.snapshot
+    if not fields and not drop_nulls and limit is None and cursor is None:
+        return catalog_response(request, snapshot, snapshot.products_body)
+    return catalog_list_response(request, snapshot, "products", fields, drop_nulls, limit, cursor)
 
-@app.get("/api/products/{product_id}")
-async def get_product(product_id: str, api_key: str = Depends(get_api_key)):
-    """Get a specific product by ID"""
-    if not data_store.products:
+@app.get("/api/countries")
+async def get_countries(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated country fields to return"),
+    drop_nulls: bool = Query(False, description="Omit fields whose value is null"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of countries to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    api_key: str = Depends(get_api_key)
+):
+    """Get all countries, optionally projected and paginated"""
+    if not data_store.countries:
         await fetch_wordpress_data()
     
-    for product in data_store.products:
-        if product.get("Product_id") == product_id:
-            return product
-    
-    raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
+    snapshot = data_store.snapshot
+    if not fields and not drop_nulls and limit is None and cursor is None:
+        return catalog_response(request, snapshot, snapshot.countries_body)
+    return catalog_list_response(request, snapshot, "countries", fields, drop_nulls, limit, cursor)
 
 @app.get("/api/products/filter")
 async def filter_products(
+    response: Response,
     country_code: Optional[str] = Query(None, description="Filter by country code"),
     price_group: Optional[str] = Query(None, description="Filter by price group"),
     min_days: Optional[int] = Query(None, description="Minimum days"),
@@ -373,52 +2188,53 @@ async def filter_products(
     min_gb: Optional[float] = Query(None, description="Minimum GB"),
     max_gb: Optional[float] = Query(None, description="Maximum GB"),
     provider_id: Optional[str] = Query(None, description="Filter by provider ID"),
+    sort: Optional[str] = Query(None, pattern="^(price|gb|days)$", description="Sort ascending by price, gb or days"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of products to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     api_key: str = Depends(get_api_key)
 ):
-    """Filter products by various criteria"""
+    """Filter products by various criteria, optionally sorted and paginated"""
     if not data_store.products:
         await fetch_wordpress_data()
 
-    filtered_products = data_store.products.copy()
-    
-    # Filter by country code
-    if country_code:
-        # First identify the price group for this country
-        target_price_group = None
-        for country in data_store.countries:
-            if country.get("Country_Code") == country_code:
-                target_price_group = country.get("Price_group")
-                break
-        
-        if target_price_group:
-            filtered_products = [p for p in filtered_products if p.get("Price_group") == target_price_group]
-        else:
-            # If no price group found for this country, return empty list
-            return {"products": [], "last_updated": data_store.last_updated}
-    
-    # Filter by price group directly
-    if price_group:
-        filtered_products = [p for p in filtered_products if p.get("Price_group") == price_group]
-    
-    # Filter by days
-    if min_days is not None:
-        filtered_products = [p for p in filtered_products if p.get("Days") and int(p.get("Days", 0)) >= min_days]
-    
-    if max_days is not None:
-        filtered_products = [p for p in filtered_products if p.get("Days") and int(p.get("Days", 0)) <= max_days]
+    snapshot = data_store.snapshot
+    query = ProductQuery(
+        snapshot,
+        country_code=country_code,
+        price_group=price_group,
+        min_days=min_days,
+        max_days=max_days,
+        min_gb=min_gb,
+        max_gb=max_gb,
+        provider_id=provider_id,
+    )
+    if sort is None and limit is None and cursor is None:
+        positions, next_rank = query.positions(), None
+    else:
+        fingerprint = query.fingerprint(sort)
+        after = decode_cursor(cursor, snapshot, fingerprint) if cursor else None
+        positions, next_rank = query.top(sort, limit, after)
     
-    # Filter by GB (need to convert from string like "5GB" to float)
-    if min_gb is not None:
-        filtered_products = [p for p in filtered_products if parse_gb(p.get("GB", "0")) >= min_gb]
+    # Expose the chosen plan and candidate counts for slow-query investigation
+    if DEBUG_MODE:
+        response.headers["X-Query-Plan"] = query.explain()
     
-    if max_gb is not None:
-        filtered_products = [p for p in filtered_products if parse_gb(p.get("GB", "0")) <= max_gb]
+    result = {"products": snapshot.products_at(positions), "last_updated": snapshot.last_updated}
+    if limit is not None or cursor is not None:
+        result["next_cursor"] = encode_cursor(snapshot.digest, fingerprint, next_rank) if next_rank is not None else None
+    return result
+
+@app.get("/api/products/{product_id}")
+async def get_product(product_id: str, api_key: str = Depends(get_api_key)):
+    """Get a specific product by ID"""
+    if not data_store.products:
+        await fetch_wordpress_data()
     
-    # Filter by provider ID
-    if provider_id:
-        filtered_products = [p for p in filtered_products if p.get("Provider_id") == provider_id]
+    product = data_store.snapshot.products_by_id.get(product_id)
+    if product is not None:
+        return product
     
-    return {"products": filtered_products, "last_updated": data_store.last_updated}
+    raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
 
 @app.get("/api/countries/region/{region_code}")
 async def get_countries_by_region(
@@ -429,23 +2245,33 @@ async def get_countries_by_region(
     if not data_store.countries:
         await fetch_wordpress_data()
     
-    filtered_countries = [c for c in data_store.countries if c.get("Country_Region") == region_code]
+    snapshot = data_store.snapshot
+    filtered_countries = snapshot.countries_by_region.get(region_code, ())
+    
+    return {"countries": filtered_countries, "last_updated": snapshot.last_updated}
+
+@app.get("/api/countries/{country_code}/offers")
+async def get_country_offers(request: Request, country_code: str, api_key: str = Depends(get_api_key)):
+    """Get the products sold in a country with their resolved USD price"""
+    if not data_store.products or not data_store.countries:
+        await fetch_wordpress_data()
+    
+    snapshot = data_store.snapshot
+    if country_code not in snapshot.countries_by_code:
+        raise HTTPException(status_code=404, detail=f"Country with code {country_code} not found")
     
-    return {"countries": filtered_countries, "last_updated": data_store.last_updated}
+    price_group = snapshot.price_group_for_country(country_code)
+    return catalog_response(request, snapshot, snapshot.offers_body(price_group))
 
 @app.get("/api/price-groups")
-async def get_price_groups(api_key: str = Depends(get_api_key)):
-    """Get all unique price groups"""
+async def get_price_groups(request: Request, api_key: str = Depends(get_api_key)):
+    """Get all unique price groups with their product counts, countries and price/GB/Days ranges"""
     if not data_store.products:
         await fetch_wordpress_data()
     
-    # Get unique price groups
-    price_groups = set()
-    for product in data_store.products:
-        if "Price_group" in product and product["Price_group"]:
-            price_groups.add(product["Price_group"])
-    
-    return {"price_groups": sorted(list(price_groups)), "last_updated": data_store.last_updated}
+    # Materialized once per refresh
+    snapshot = data_store.snapshot
+    return catalog_response(request, snapshot, snapshot.price_groups_body)
 
 @app.get("/api/health")
 async def health_check():
@@ -463,76 +2289,87 @@ async def health_check():
 async def debug_info(api_key: str = Depends(get_api_key)):
     """Get debug information about the current configuration"""
     try:
-        async with httpx.AsyncClient() as client:
-            base_url = WORDPRESS_URL
-            base_api_url = f"{WORDPRESS_URL}/wp-json"
-            plugin_url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/data"
-            
-            base_reachable = False
-            base_api_reachable = False
-            plugin_api_reachable = False
-            base_error = None
-            base_api_error = None
-            plugin_error = None
-            plugin_data = None
+        client = upstream_clients.get("wordpress")
+        base_url = WORDPRESS_URL
+        base_api_url = f"{WORDPRESS_URL}/wp-json"
+        plugin_url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/data"
+        
+        base_reachable = False
+        base_api_reachable = False
+        plugin_api_reachable = False
+        base_error = None
+        base_api_error = None
+        plugin_error = None
+        plugin_data = None
+        
+        if not USE_SAMPLE_DATA:
+            try:
+                base_response = await client.get(base_url, timeout=10.0)
+                base_reachable = base_response.status_code < 400
+            except Exception as e:
+                base_error = str(e)
             
-            if not USE_SAMPLE_DATA:
-                try:
-                    base_response = await client.get(base_url, timeout=10.0)
-                    base_reachable = base_response.status_code < 400
-                except Exception as e:
-                    base_error = str(e)
+            try:
+                base_api_response = await client.get(base_api_url, timeout=10.0)
+                base_api_reachable = base_api_response.status_code < 400
+            except Exception as e:
+                base_api_error = str(e)
                 
-                try:
-                    base_api_response = await client.get(base_api_url, timeout=10.0)
-                    base_api_reachable = base_api_response.status_code < 400
-                except Exception as e:
-                    base_api_error = str(e)
-                    
-                try:
-                    plugin_response = await client.get(plugin_url, timeout=10.0)
-                    plugin_api_reachable = plugin_response.status_code < 400
-                    plugin_data = plugin_response.text[:100] + "..." if plugin_response.status_code < 400 else None
-                except Exception as e:
-                    plugin_error = str(e)
-            
-            return {
-                "config": {
-                    "wordpress_url": WORDPRESS_URL,
-                    "refresh_interval": REFRESH_INTERVAL,
-                    "debug_mode": DEBUG_MODE,
-                    "using_sample_data": USE_SAMPLE_DATA,
-                    "environment_variables": {
-                        "CONNECTION_ERROR_TEST": os.getenv("CONNECTION_ERROR_TEST", "not set"),
-                        "DEBUG_MODE": os.getenv("DEBUG_MODE", "not set")
-                    }
+            try:
+                plugin_response = await client.get(plugin_url, timeout=10.0)
+                plugin_api_reachable = plugin_response.status_code < 400
+                plugin_data = plugin_response.text[:100] + "..." if plugin_response.status_code < 400 else None
+            except Exception as e:
+                plugin_error = str(e)
+        
+        return {
+            "config": {
+                "wordpress_url": WORDPRESS_URL,
+                "refresh_interval": REFRESH_INTERVAL,
+                "debug_mode": DEBUG_MODE,
+                "using_sample_data": USE_SAMPLE_DATA,
+                "environment_variables": {
+                    "CONNECTION_ERROR_TEST": os.getenv("CONNECTION_ERROR_TEST", "not set"),
+                    "DEBUG_MODE": os.getenv("DEBUG_MODE", "not set")
+                }
+            },
+            "connection_tests": {
+                "wordpress_base_url": {
+                    "url": base_url,
+                    "reachable": base_reachable if not USE_SAMPLE_DATA else "skipped (using sample data)",
+                    "error": base_error
                 },
-                "connection_tests": {
-                    "wordpress_base_url": {
-                        "url": base_url,
-                        "reachable": base_reachable if not USE_SAMPLE_DATA else "skipped (using sample data)",
-                        "error": base_error
-                    },
-                    "wordpress_api_base": {
-                        "url": base_api_url,
-                        "reachable": base_api_reachable if not USE_SAMPLE_DATA else "skipped (using sample data)",
-                        "error": base_api_error
-                    },
-                    "esim_plugin_endpoint": {
-                        "url": plugin_url,
-                        "reachable": plugin_api_reachable if not USE_SAMPLE_DATA else "skipped (using sample data)",
-                        "error": plugin_error,
-                        "sample_data": plugin_data
-                    }
+                "wordpress_api_base": {
+                    "url": base_api_url,
+                    "reachable": base_api_reachable if not USE_SAMPLE_DATA else "skipped (using sample data)",
+                    "error": base_api_error
                 },
-                "data_store": {
-                    "has_products": len(data_store.products) > 0,
-                    "product_count": len(data_store.products),
-                    "has_countries": len(data_store.countries) > 0,
-                    "country_count": len(data_store.countries),
-                    "last_updated": data_store.last_updated
+                "esim_plugin_endpoint": {
+                    "url": plugin_url,
+                    "reachable": plugin_api_reachable if not USE_SAMPLE_DATA else "skipped (using sample data)",
+                    "error": plugin_error,
+                    "sample_data": plugin_data
                 }
+            },
+            "data_store": {
+                "has_products": len(data_store.products) > 0,
+                "product_count": len(data_store.products),
+                "has_countries": len(data_store.countries) > 0,
+                "country_count": len(data_store.countries),
+                "catalog_version": data_store.snapshot.version,
+                "last_updated": data_store.last_updated,
+                "quarantined": data_store.snapshot.quarantine
+            },
+            "iccid_cache": iccid_cache.summary(),
+            "iccid_hedge": iccid_hedge.summary(),
+            "process": {
+                "pid": os.getpid(),
+                "preloaded_catalog": data_store.preloaded,
+                "shared_catalog": "leader" if shared_catalog.is_leader else "follower" if shared_catalog.is_follower else "disabled",
+                "catalog_cache_file": CATALOG_CACHE_FILE or None,
+                "memory": process_memory()
             }
+        }
     except Exception as e:
         return {
             "error": f"Error running diagnostics: {str(e)}",
@@ -658,6 +2495,42 @@ ESIM_PROVIDER_API_KEY = os.getenv("ESIM_PROVIDER_API_KEY", "")
 ESIM_PROVIDER_CLIENT_ID = os.getenv("ESIM_PROVIDER_CLIENT_ID", "")
 ESIM_PROVIDER_CLIENT_SECRET = os.getenv("ESIM_PROVIDER_CLIENT_SECRET", "")
 
+# ICCID lookup cache: seconds a result is fresh, by where it came from
+ICCID_CACHE_SIZE = int(os.getenv("ICCID_CACHE_SIZE", "10000"))
+ICCID_CACHE_TTL_WORDPRESS = float(os.getenv("ICCID_CACHE_TTL_WORDPRESS", "60"))
+ICCID_CACHE_TTL_TELCOVISION = float(os.getenv("ICCID_CACHE_TTL_TELCOVISION", "30"))
+ICCID_CACHE_TTL_NOT_FOUND = float(os.getenv("ICCID_CACHE_TTL_NOT_FOUND", "10"))
+ICCID_CACHE_STALE_TTL = float(os.getenv("ICCID_CACHE_STALE_TTL", "300"))  # Extra seconds a result may be served while it is refreshed
+
+# Prefetch of frequently looked up ICCIDs before their cache entries expire
+ICCID_PREFETCH_ENABLED = os.getenv("ICCID_PREFETCH_ENABLED", "false").lower() == "true"
+ICCID_PREFETCH_LEAD = float(os.getenv("ICCID_PREFETCH_LEAD", "10"))  # Seconds before expiry a hot entry is refreshed
+ICCID_PREFETCH_MIN_SCORE = float(os.getenv("ICCID_PREFETCH_MIN_SCORE", "3"))  # Decayed lookup count that makes an ICCID hot
+ICCID_PREFETCH_HALF_LIFE = float(os.getenv("ICCID_PREFETCH_HALF_LIFE", "300"))  # Seconds for a lookup to count half as much
+ICCID_PREFETCH_CONCURRENCY = int(os.getenv("ICCID_PREFETCH_CONCURRENCY", "4"))
+ICCID_PREFETCH_INTERVAL = float(os.getenv("ICCID_PREFETCH_INTERVAL", "1"))
+
+# Hedged ICCID lookups: start TelcoVision when WordPress is slower than usual
+ICCID_HEDGE_ENABLED = os.getenv("ICCID_HEDGE_ENABLED", "false").lower() == "true"
+ICCID_HEDGE_PERCENTILE = float(os.getenv("ICCID_HEDGE_PERCENTILE", "95"))  # Percentile of recent WordPress response times to wait
+ICCID_HEDGE_MIN_DELAY = float(os.getenv("ICCID_HEDGE_MIN_DELAY", "0.05"))
+ICCID_HEDGE_MAX_DELAY = float(os.getenv("ICCID_HEDGE_MAX_DELAY", "2"))  # Also used until enough response times are known
+ICCID_HEDGE_WINDOW = int(os.getenv("ICCID_HEDGE_WINDOW", "200"))  # Recent WordPress response times kept
+
+# Batch ICCID lookups
+ICCID_BATCH_MAX_SIZE = int(os.getenv("ICCID_BATCH_MAX_SIZE", "500"))
+ICCID_BATCH_CONCURRENCY = max(1, int(os.getenv("ICCID_BATCH_CONCURRENCY", "8")))  # Lookups in flight per batch request
+
+# TelcoVision request headers, built once
+TELCOVISION_HEADERS = {
+    "Content-Type": "application/json",
+    "X-API-KEY": ESIM_PROVIDER_API_KEY
+}
+# Additional credentials if provided
+if ESIM_PROVIDER_CLIENT_ID and ESIM_PROVIDER_CLIENT_SECRET:
+    TELCOVISION_HEADERS["X-CLIENT-ID"] = ESIM_PROVIDER_CLIENT_ID
+    TELCOVISION_HEADERS["X-CLIENT-SECRET"] = ESIM_PROVIDER_CLIENT_SECRET
+
 # Add ICCID lookup function
 async def fetch_iccid_data(iccid: str) -> Dict[str, Any]:
     """
@@ -666,7 +2539,25 @@ async def fetch_iccid_data(iccid: str) -> Dict[str, Any]:
     if DEBUG_MODE:
         print(f"Fetching ICCID data for: {iccid}")
     
-    # First try to get data from WordPress (PRIMARY SOURCE)
+    if iccid_hedge.enabled:
+        # Race TelcoVision against a slow WordPress lookup
+        result = await iccid_hedge.race(iccid)
+    else:
+        result = await fetch_iccid_data_primary(iccid)
+        if result is None or result.get("not_found"):
+            result = iccid_answer(result, await fetch_iccid_data_fallback(iccid))
+    if result is not None:
+        return result
+    
+    return sample_iccid_data(iccid)
+
+async def fetch_iccid_data_primary(iccid: str) -> Optional[Dict[str, Any]]:
+    """
+    Valid ICCID data or a 404 from WordPress, or None if it failed
+
+    TelcoVision should still be tried after a 404.
+    """
+    started = time.monotonic()
     try:
         # Get data from WordPress as the primary source
         wordpress_data = await fetch_iccid_data_from_wordpress(iccid)
@@ -680,6 +2571,9 @@ async def fetch_iccid_data(iccid: str) -> Dict[str, Any]:
             if "source" not in wordpress_data:
                 wordpress_data["source"] = "wordpress_primary"
                 
+            return wordpress_data
+        elif wordpress_data and wordpress_data.get("status_code") == 404:
+            print(f"ICCID {iccid} not found in WordPress, trying TelcoVision as fallback")
             return wordpress_data
         else:
             # If WordPress data retrieval failed or returned empty, try TelcoVision as fallback
@@ -688,85 +2582,39 @@ async def fetch_iccid_data(iccid: str) -> Dict[str, Any]:
         # If there's an error with WordPress, log it and try TelcoVision
         print(f"Error fetching data from WordPress for ICCID {iccid}: {str(e)}")
         print("Trying TelcoVision as fallback")
-    
+    finally:
+        # Lookups cancelled by a hedge still count, as a lower bound
+        iccid_hedge.observe(time.monotonic() - started)
+    return None
+
+def iccid_answer(wordpress: Optional[Dict[str, Any]], telcovision: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Pick TelcoVision's answer after WordPress had none, keeping a WordPress 404 (which is cached) over a failure
+    """
+    if wordpress is not None and (telcovision is None or "error" in telcovision):
+        return wordpress
+    return telcovision
+
+async def fetch_iccid_data_fallback(iccid: str) -> Optional[Dict[str, Any]]:
+    """
+    ICCID data from TelcoVision, or None if it is not configured or failed
+    """
     # Only proceed with TelcoVision if it's configured
-    if os.getenv("ESIM_PROVIDER_API_URL") and os.getenv("ESIM_PROVIDER_API_KEY"):
+    if ESIM_PROVIDER_API_URL and ESIM_PROVIDER_API_KEY:
         try:
             # Get data from TelcoVision OCS API as fallback
-            async with httpx.AsyncClient() as client:
-                base_url = os.getenv("ESIM_PROVIDER_API_URL")
-                api_key = os.getenv("ESIM_PROVIDER_API_KEY")
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-API-KEY": api_key
-                }
-                
-                # Additional credentials if provided
-                client_id = os.getenv("ESIM_PROVIDER_CLIENT_ID")
-                client_secret = os.getenv("ESIM_PROVIDER_CLIENT_SECRET")
-                if client_id and client_secret:
-                    headers["X-CLIENT-ID"] = client_id
-                    headers["X-CLIENT-SECRET"] = client_secret
-                
-                # Get subscriber information
-                subscriber_url = f"{base_url}/subscribers/{iccid}"
-                try:
-                    subscriber_response = await client.get(subscriber_url, headers=headers, timeout=30.0)
-                    if subscriber_response.status_code != 200:
-                        print(f"Error fetching subscriber data from TelcoVision: HTTP {subscriber_response.status_code}")
-                        print(f"Response: {subscriber_response.text}")
-                        # Return empty data if subscriber not found
-                        return {"subscriber": {}, "packages": [], "not_found": True, "source": "telco_vision_fallback"}
-                    
-                    subscriber_data = subscriber_response.json()
-                except httpx.RequestError as e:
-                    print(f"Error connecting to TelcoVision for subscriber data: {str(e)}")
-                    # Return empty data on connection error
-                    return {"subscriber": {}, "packages": [], "error": str(e), "source": "telco_vision_fallback"}
-                
-                # Get package information
-                packages_url = f"{base_url}/subscribers/{iccid}/packages"
-                try:
-                    packages_response = await client.get(packages_url, headers=headers, timeout=30.0)
-                    if packages_response.status_code != 200:
-                        print(f"Error fetching package data from TelcoVision: HTTP {packages_response.status_code}")
-                        # Still return subscriber data if available
-                        return {
-                            "subscriber": subscriber_data.get('getSingleSubscriber', {}),
-                            "packages": [],
-                            "partial_data": True,
-                            "source": "telco_vision_fallback"
-                        }
-                    
-                    packages_data = packages_response.json()
-                except httpx.RequestError as e:
-                    print(f"Error connecting to TelcoVision for package data: {str(e)}")
-                    # Still return subscriber data if available
-                    return {
-                        "subscriber": subscriber_data.get('getSingleSubscriber', {}),
-                        "packages": [],
-                        "partial_data": True,
-                        "error": str(e),
-                        "source": "telco_vision_fallback"
-                    }
-                
-                # Combine the data
-                combined_data = {
-                    "subscriber": subscriber_data.get('getSingleSubscriber', {}),
-                    "packages": packages_data.get('listSubscriberPrepaidPackages', {}).get('packages', []),
-                    "source": "telco_vision_fallback"
-                }
-                
-                if DEBUG_MODE:
-                    print(f"Successfully fetched data from TelcoVision for ICCID {iccid}")
-                    
-                return combined_data
+            return await fetch_iccid_data_from_telcovision(iccid)
         except Exception as e:
             print(f"General error fetching ICCID data from TelcoVision: {str(e)}")
     else:
         if DEBUG_MODE:
             print("TelcoVision OCS API not configured, skipping fallback")
-    
+    return None
+
+def sample_iccid_data(iccid: str) -> Dict[str, Any]:
+    """
+    Final fallback when no source has data for an ICCID
+    """
     # If we couldn't get data from WordPress or TelcoVision, return sample data if allowed
     if os.getenv("ALLOW_SAMPLE_DATA_FALLBACK", "false").lower() == "true":
         print(f"Returning sample data for ICCID {iccid} as final fallback")
@@ -794,6 +2642,89 @@ async def fetch_iccid_data(iccid: str) -> Dict[str, Any]:
         # Return empty data if all options failed and sample data is not allowed
         return {"subscriber": {}, "packages": [], "error": "No data available from any source", "source": "none"}
 
+async def fetch_iccid_data_from_telcovision(iccid: str) -> Dict[str, Any]:
+    """
+    Fetch ICCID data from the TelcoVision OCS API.
+
+    The subscriber and packages requests are independent, so both are sent at
+    once; if the subscriber lookup fails the packages request is cancelled.
+    """
+    client = upstream_clients.get("telcovision")
+    base_url = ESIM_PROVIDER_API_URL
+    headers = TELCOVISION_HEADERS
+    
+    subscriber_url = f"{base_url}/subscribers/{iccid}"
+    packages_url = f"{base_url}/subscribers/{iccid}/packages"
+    subscriber_request = asyncio.ensure_future(client.get(subscriber_url, headers=headers, timeout=30.0))
+    packages_request = asyncio.ensure_future(client.get(packages_url, headers=headers, timeout=30.0))
+    
+    try:
+        # Get subscriber information
+        try:
+            subscriber_response = await subscriber_request
+            if subscriber_response.status_code != 200:
+                print(f"Error fetching subscriber data from TelcoVision: HTTP {subscriber_response.status_code}")
+                print(f"Response: {subscriber_response.text}")
+                # Return empty data if subscriber not found; other statuses (5xx, 429) are errors
+                if subscriber_response.status_code == 404:
+                    return {"subscriber": {}, "packages": [], "not_found": True, "status_code": 404, "source": "telco_vision_fallback"}
+                return {
+                    "subscriber": {},
+                    "packages": [],
+                    "error": f"TelcoVision API returned {subscriber_response.status_code}",
+                    "status_code": subscriber_response.status_code,
+                    "source": "telco_vision_fallback"
+                }
+            
+            subscriber_data = subscriber_response.json()
+        except httpx.RequestError as e:
+            print(f"Error connecting to TelcoVision for subscriber data: {str(e)}")
+            # Return empty data on connection error
+            return {"subscriber": {}, "packages": [], "error": str(e), "source": "telco_vision_fallback"}
+        
+        # Get package information
+        try:
+            packages_response = await packages_request
+            if packages_response.status_code != 200:
+                print(f"Error fetching package data from TelcoVision: HTTP {packages_response.status_code}")
+                # Still return subscriber data if available
+                return {
+                    "subscriber": subscriber_data.get('getSingleSubscriber', {}),
+                    "packages": [],
+                    "partial_data": True,
+                    "source": "telco_vision_fallback"
+                }
+            
+            packages_data = packages_response.json()
+        except httpx.RequestError as e:
+            print(f"Error connecting to TelcoVision for package data: {str(e)}")
+            # Still return subscriber data if available
+            return {
+                "subscriber": subscriber_data.get('getSingleSubscriber', {}),
+                "packages": [],
+                "partial_data": True,
+                "error": str(e),
+                "source": "telco_vision_fallback"
+            }
+    finally:
+        if not packages_request.done():
+            packages_request.cancel()
+        elif not packages_request.cancelled():
+            # Mark a failure we returned early on as retrieved
+            packages_request.exception()
+    
+    # Combine the data
+    combined_data = {
+        "subscriber": subscriber_data.get('getSingleSubscriber', {}),
+        "packages": packages_data.get('listSubscriberPrepaidPackages', {}).get('packages', []),
+        "source": "telco_vision_fallback"
+    }
+    
+    if DEBUG_MODE:
+        print(f"Successfully fetched data from TelcoVision for ICCID {iccid}")
+        
+    return combined_data
+
 async def fetch_iccid_data_from_wordpress(iccid: str) -> Dict[str, Any]:
     """
     Fetch ICCID data from WordPress as a fallback when Telco Vision OCS API is unavailable
@@ -802,97 +2733,89 @@ async def fetch_iccid_data_from_wordpress(iccid: str) -> Dict[str, Any]:
         print(f"Fetching ICCID data from WordPress for: {iccid}")
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Set up WordPress API URL for ICCID lookup
-            url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/iccid/{iccid}"
-            
-            # Set up authentication headers
-            headers = {}
-            if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD:
-                # Remove spaces from app password if present
-                app_password = WORDPRESS_APP_PASSWORD.replace(" ", "")
-                import base64
-                auth_string = f"{WORDPRESS_APP_USERNAME}:{app_password}"
-                encoded_auth = base64.b64encode(auth_string.encode()).decode()
-                headers["Authorization"] = f"Basic {encoded_auth}"
-            elif API_KEY:
-                headers["Authorization"] = f"Bearer {API_KEY}"
-            
-            if DEBUG_MODE:
-                print(f"Making request to WordPress API: {url}")
+        client = upstream_clients.get("wordpress")
+        # Set up WordPress API URL for ICCID lookup
+        url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/iccid/{iccid}"
+        
+        # Set up authentication headers
+        headers = dict(WORDPRESS_AUTH_HEADERS)
+        
+        if DEBUG_MODE:
+            print(f"Making request to WordPress API: {url}")
+        
+        try:
+            response = await client.get(url, headers=headers, timeout=30.0)
             
-            try:
-                response = await client.get(url, headers=headers, timeout=30.0)
+            if response.status_code == 200:
+                wordpress_data = response.json()
+                if DEBUG_MODE:
+                    print(f"Successfully fetched ICCID data from WordPress for {iccid}")
                 
-                if response.status_code == 200:
-                    wordpress_data = response.json()
-                    if DEBUG_MODE:
-                        print(f"Successfully fetched ICCID data from WordPress for {iccid}")
-                    
-                    # Convert WordPress data to the format expected by the ICCID endpoint
-                    wp_formatted_data = {
-                        "subscriber": {
-                            "sim": {
-                                "id": wordpress_data.get("subscriber_id", ""),
-                                "state": "ACTIVATED" if wordpress_data.get("status") == "active" else "UNAVAILABLE"
-                            }
-                        },
-                        "packages": []
-                    }
-                    
-                    # Add package data if available
-                    if wordpress_data.get("plan_id") and wordpress_data.get("total_data"):
-                        # Convert data strings like "5GB" to bytes (approximate)
-                        def parse_data_to_bytes(data_str):
-                            try:
-                                # Remove 'GB' and convert to bytes (1 GB = 1024^3 bytes)
-                                gb_value = float(data_str.replace('GB', '').strip())
-                                return int(gb_value * 1024 * 1024 * 1024)
-                            except:
-                                return 0
-                        
-                        total_bytes = parse_data_to_bytes(wordpress_data.get("total_data", "0GB"))
-                        used_bytes = parse_data_to_bytes(wordpress_data.get("used_data", "0GB"))
-                        
-                        wp_formatted_data["packages"].append({
-                            "id": wordpress_data.get("plan_id", ""),
-                            "name": wordpress_data.get("plan_name", "WordPress Plan"),
-                            "active": True,
-                            "pckdatabyte": total_bytes,
-                            "useddatabyte": used_bytes,
-                            "tsactivationutc": wordpress_data.get("activation_date", datetime.now().isoformat()),
-                            "tsexpirationutc": wordpress_data.get("expiry_date", (datetime.now() + timedelta(days=30)).isoformat())
-                        })
+                # Convert WordPress data to the format expected by the ICCID endpoint
+                wp_formatted_data = {
+                    "subscriber": {
+                        "sim": {
+                            "id": wordpress_data.get("subscriber_id", ""),
+                            "state": "ACTIVATED" if wordpress_data.get("status") == "active" else "UNAVAILABLE"
+                        }
+                    },
+                    "packages": []
+                }
+                
+                # Add package data if available
+                if wordpress_data.get("plan_id") and wordpress_data.get("total_data"):
+                    # Convert data strings like "5GB" to bytes (approximate)
+                    def parse_data_to_bytes(data_str):
+                        try:
+                            # Remove 'GB' and convert to bytes (1 GB = 1024^3 bytes)
+                            gb_value = float(data_str.replace('GB', '').strip())
+                            return int(gb_value * 1024 * 1024 * 1024)
+                        except:
+                            return 0
                     
-                    return wp_formatted_data
-                elif response.status_code == 404:
-                    if DEBUG_MODE:
-                        print(f"ICCID {iccid} not found in WordPress")
+                    total_bytes = parse_data_to_bytes(wordpress_data.get("total_data", "0GB"))
+                    used_bytes = parse_data_to_bytes(wordpress_data.get("used_data", "0GB"))
                     
-                    # Return mock data structure for not found
-                    return {
-                        "subscriber": {},
-                        "packages": [],
-                        "not_found": True,
-                        "source": "wordpress_fallback"
-                    }
-                else:
-                    print(f"Error fetching ICCID from WordPress: HTTP {response.status_code} - {response.text}")
-                    # Return empty data structure for error
-                    return {
-                        "subscriber": {},
-                        "packages": [],
-                        "error": f"WordPress API returned {response.status_code}",
-                        "source": "wordpress_fallback"
-                    }
-            except httpx.RequestError as e:
-                print(f"Error connecting to WordPress for ICCID lookup: {str(e)}")
+                    wp_formatted_data["packages"].append({
+                        "id": wordpress_data.get("plan_id", ""),
+                        "name": wordpress_data.get("plan_name", "WordPress Plan"),
+                        "active": True,
+                        "pckdatabyte": total_bytes,
+                        "useddatabyte": used_bytes,
+                        "tsactivationutc": wordpress_data.get("activation_date", datetime.now().isoformat()),
+                        "tsexpirationutc": wordpress_data.get("expiry_date", (datetime.now() + timedelta(days=30)).isoformat())
+                    })
+                
+                return wp_formatted_data
+            elif response.status_code == 404:
+                if DEBUG_MODE:
+                    print(f"ICCID {iccid} not found in WordPress")
+                
+                # Return mock data structure for not found
+                return {
+                    "subscriber": {},
+                    "packages": [],
+                    "not_found": True,
+                    "status_code": 404,
+                    "source": "wordpress_fallback"
+                }
+            else:
+                print(f"Error fetching ICCID from WordPress: HTTP {response.status_code} - {response.text}")
+                # Return empty data structure for error
                 return {
                     "subscriber": {},
                     "packages": [],
-                    "error": f"Connection error: {str(e)}",
+                    "error": f"WordPress API returned {response.status_code}",
                     "source": "wordpress_fallback"
                 }
+        except httpx.RequestError as e:
+            print(f"Error connecting to WordPress for ICCID lookup: {str(e)}")
+            return {
+                "subscriber": {},
+                "packages": [],
+                "error": f"Connection error: {str(e)}",
+                "source": "wordpress_fallback"
+            }
     except Exception as e:
         print(f"General error fetching ICCID data from WordPress: {str(e)}")
         return {
@@ -902,135 +2825,408 @@ async def fetch_iccid_data_from_wordpress(iccid: str) -> Dict[str, Any]:
             "source": "wordpress_fallback"
         }
 
+# Hedged WordPress/TelcoVision ICCID lookups
+class ICCIDHedge:
+    """
+    Races TelcoVision against WordPress lookups that run long.
+
+    WordPress is given a head start of ICCID_HEDGE_PERCENTILE of its recent
+    response times (clamped to ICCID_HEDGE_MIN_DELAY..ICCID_HEDGE_MAX_DELAY)
+    before TelcoVision is started alongside it. The first usable answer wins
+    and the other lookup is cancelled. WordPress wins if both are ready, and a
+    TelcoVision answer that is partial, not_found or an error only counts once
+    WordPress has failed or returned 404 too, which is what the sequential
+    path returns; WordPress's 404 is returned if TelcoVision has no answer.
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, enabled: bool, percentile: float, min_delay: float, max_delay: float, window: int):
+        self.enabled = enabled
+        self.percentile = min(max(percentile, 0.0), 100.0) / 100
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.latencies = deque(maxlen=window)
+        self.stats = {"lookups": 0, "hedged": 0, "wordpress_wins": 0, "telcovision_wins": 0, "no_winner": 0}
+
+    def observe(self, seconds: float):
+        self.latencies.append(seconds)
+
+    def delay(self) -> float:
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return self.max_delay
+        ordered = sorted(self.latencies)
+        value = ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+        return min(max(value, self.min_delay), self.max_delay)
+
+    @staticmethod
+    def usable(result: Optional[Dict[str, Any]]) -> bool:
+        return result is not None and not result.get("not_found") and not result.get("partial_data") and "error" not in result
+
+    async def race(self, iccid: str) -> Optional[Dict[str, Any]]:
+        self.stats["lookups"] += 1
+        primary = asyncio.ensure_future(fetch_iccid_data_primary(iccid))
+        secondary = None
+        try:
+            await asyncio.wait({primary}, timeout=self.delay())
+            if primary.done():
+                result = primary.result()
+                if result is None or result.get("not_found"):
+                    return iccid_answer(result, await fetch_iccid_data_fallback(iccid))
+                return result
+            
+            self.stats["hedged"] += 1
+            if DEBUG_MODE:
+                print(f"WordPress slow for ICCID {iccid}, starting TelcoVision in parallel")
+            secondary = asyncio.ensure_future(fetch_iccid_data_fallback(iccid))
+            pending = {primary, secondary}
+            while pending:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if primary.done() and self.usable(primary.result()):
+                    self.stats["wordpress_wins"] += 1
+                    return primary.result()
+                if secondary.done() and self.usable(secondary.result()):
+                    self.stats["telcovision_wins"] += 1
+                    return secondary.result()
+            self.stats["no_winner"] += 1
+            return iccid_answer(primary.result(), secondary.result())
+        finally:
+            # Cancel the losing lookup (or both, if we were cancelled)
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def summary(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        return {
+            "enabled": self.enabled,
+            "delay_ms": round(self.delay() * 1000, 1),
+            "samples": len(self.latencies),
+            "hedge_rate": round(self.stats["hedged"] / lookups, 4) if lookups else 0.0,
+            **self.stats
+        }
+
+iccid_hedge = ICCIDHedge(
+    ICCID_HEDGE_ENABLED and bool(ESIM_PROVIDER_API_URL and ESIM_PROVIDER_API_KEY),
+    ICCID_HEDGE_PERCENTILE, ICCID_HEDGE_MIN_DELAY, ICCID_HEDGE_MAX_DELAY, ICCID_HEDGE_WINDOW
+)
+
+# Cache of ICCID lookups
+class ICCIDCache:
+    """
+    Bounded LRU cache of fetch_iccid_data results.
+
+    Successful results stay fresh for their source's TTL and are then served
+    stale for up to ICCID_CACHE_STALE_TTL seconds while one background fetch
+    refreshes them; a refresh that fails leaves the entry to be served until
+    the stale window ends. "not_found" results from a 404 are cached briefly; errors and
+    partial results are not cached. Concurrent misses for the same ICCID
+    share one fetch.
+
+    invalidate() (e.g. after a topup) writes a new random stamp to the
+    ICCID's slot in a table of invalidation stamps. Entries and fetches
+    remember the stamp they started under, so the entry is dropped and a
+    fetch already in flight is not cached. With SHARED_CATALOG_DIR set the table is a mapped file that
+    every worker on the host reads, so a topup handled by one worker is seen
+    by all of them on their next lookup; otherwise it only covers this worker.
+    ICCIDs sharing a slot are invalidated together, which only costs a refetch.
+
+    With prefetching on, lookups per ICCID are counted with exponential decay
+    (ICCID_PREFETCH_HALF_LIFE) and prefetch() refreshes the hottest entries
+    within ICCID_PREFETCH_LEAD seconds of expiry, so frequently checked
+    ICCIDs keep hitting without longer TTLs. Counts are only kept for cached
+    ICCIDs, and at most ICCID_PREFETCH_CONCURRENCY prefetches run at once.
+    """
+
+    INVALIDATION_SLOTS = 4096
+
+    def __init__(self, size: int, prefetch: bool = False):
+        self.size = size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # iccid -> (result, fresh_until, stale_until, stamp)
+        self.in_flight: Dict[str, tuple] = {}  # iccid -> (task, stamp)
+        self.invalidations = bytearray(8 * self.INVALIDATION_SLOTS)  # replaced by the shared mapping in open()
+        self.track = prefetch
+        self.heat: Dict[str, tuple] = {}  # iccid -> (decayed lookup count, when it was last updated)
+        self.prefetching = set()
+        self.stats = {"hits": 0, "stale_hits": 0, "negative_hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "prefetches": 0}
+
+    @staticmethod
+    def ttls(result: Dict[str, Any]) -> Optional[tuple]:
+        """(fresh, stale) seconds to keep a result, None if it should not be cached"""
+        if result.get("not_found"):
+            # Only a real 404 is remembered; anything else may be transient
+            return (ICCID_CACHE_TTL_NOT_FOUND, 0) if result.get("status_code") == 404 else None
+        if "error" in result or result.get("partial_data") or not result.get("subscriber"):
+            return None
+        if result.get("source") == "wordpress_primary":
+            return ICCID_CACHE_TTL_WORDPRESS, ICCID_CACHE_STALE_TTL
+        if result.get("source") == "telco_vision_fallback":
+            return ICCID_CACHE_TTL_TELCOVISION, ICCID_CACHE_STALE_TTL
+        return None
+
+    async def get(self, iccid: str, fetch) -> Dict[str, Any]:
+        now = time.monotonic()
+        if self.track:
+            self.heat[iccid] = (self.score(iccid, now) + 1, now)
+        entry = self.entries.get(iccid)
+        if entry is not None:
+            result, fresh_until, stale_until, stamp = entry
+            if stamp != self.stamp(iccid):
+                # Invalidated, possibly by another worker
+                fresh_until = stale_until = now
+            if now < fresh_until:
+                self.entries.move_to_end(iccid)
+                self.stats["negative_hits" if result.get("not_found") else "hits"] += 1
+                return result
+            if now < stale_until:
+                self.entries.move_to_end(iccid)
+                self.stats["stale_hits"] += 1
+                self._fetch(iccid, fetch)
+                return result
+            del self.entries[iccid]
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._fetch(iccid, fetch))
+
+    def open(self, directory: str):
+        """Share invalidations with the other workers through a mapped file; called after fork"""
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, "iccid.invalidations"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < len(self.invalidations):
+                os.ftruncate(fd, len(self.invalidations))
+            self.invalidations = mmap.mmap(fd, len(self.invalidations))
+        finally:
+            os.close(fd)
+
+    def slot(self, iccid: str) -> int:
+        return 8 * (zlib.crc32(iccid.encode()) % self.INVALIDATION_SLOTS)
+
+    def stamp(self, iccid: str) -> int:
+        return struct.unpack_from("<Q", self.invalidations, self.slot(iccid))[0]
+
+    def _fetch(self, iccid: str, fetch) -> asyncio.Task:
+        """Start (or join) the single fetch for an ICCID; its result is stored when it completes"""
+        stamp = self.stamp(iccid)
+        task, started = self.in_flight.get(iccid, (None, None))
+        if task is None or started != stamp:
+            # A fetch started before an invalidation is left to finish for its waiters only
+            task = asyncio.create_task(fetch(iccid))
+            self.in_flight[iccid] = (task, stamp)
+            task.add_done_callback(lambda done: self._store(iccid, done, stamp))
+        return task
+
+    def _store(self, iccid: str, task: asyncio.Task, stamp: int):
+        if self.in_flight.get(iccid, (None,))[0] is task:
+            del self.in_flight[iccid]
+        if task.cancelled() or task.exception() is not None or stamp != self.stamp(iccid):
+            return
+        result = task.result()
+        ttls = self.ttls(result)
+        now = time.monotonic()
+        if ttls is None:
+            # A failed refresh keeps serving the entry until its stale window ends
+            entry = self.entries.get(iccid)
+            if entry is not None and now >= entry[2]:
+                del self.entries[iccid]
+            return
+        self.entries[iccid] = (result, now + ttls[0], now + ttls[0] + ttls[1], stamp)
+        self.entries.move_to_end(iccid)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def score(self, iccid: str, now: float) -> float:
+        count, updated = self.heat.get(iccid, (0.0, now))
+        return count * 0.5 ** ((now - updated) / ICCID_PREFETCH_HALF_LIFE)
+
+    def prefetch(self, fetch):
+        """Refresh the hottest entries that are about to expire, in the background"""
+        now = time.monotonic()
+        # Forget ICCIDs that are no longer cached, which bounds heat to the cache size
+        for iccid in [iccid for iccid in self.heat if iccid not in self.entries and iccid not in self.in_flight]:
+            del self.heat[iccid]
+        
+        slots = ICCID_PREFETCH_CONCURRENCY - len(self.prefetching)
+        if slots <= 0:
+            return
+        candidates = []
+        for iccid, (result, fresh_until, stale_until, _) in self.entries.items():
+            if fresh_until - now > ICCID_PREFETCH_LEAD or now >= stale_until or result.get("not_found") or iccid in self.in_flight:
+                continue
+            score = self.score(iccid, now)
+            if score >= ICCID_PREFETCH_MIN_SCORE:
+                candidates.append((score, iccid))
+        for _, iccid in heapq.nlargest(slots, candidates):
+            task = self._fetch(iccid, fetch)
+            self.prefetching.add(task)
+            task.add_done_callback(self.prefetching.discard)
+            self.stats["prefetches"] += 1
+
+    def invalidate(self, iccid: str):
+        self.stats["invalidations"] += 1
+        # A random stamp rather than an increment, so invalidations racing in two workers can't collapse into one
+        struct.pack_into("<Q", self.invalidations, self.slot(iccid), random.getrandbits(64))
+        self.entries.pop(iccid, None)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "size": len(self.entries),
+            "capacity": self.size,
+            "in_flight": len(self.in_flight),
+            "prefetch": self.track,
+            "tracked": len(self.heat),
+            "prefetching": len(self.prefetching),
+            **self.stats
+        }
+
+iccid_cache = ICCIDCache(ICCID_CACHE_SIZE, prefetch=ICCID_PREFETCH_ENABLED)
+
+async def iccid_prefetch_loop():
+    """Keep hot ICCIDs cached by refreshing them shortly before they expire"""
+    while True:
+        await asyncio.sleep(ICCID_PREFETCH_INTERVAL)
+        try:
+            iccid_cache.prefetch(fetch_iccid_data)
+        except Exception as e:
+            print(f"Error prefetching ICCIDs: {str(e)}")
+
 # Add ICCID lookup endpoints
-@app.get("/api/iccid/{iccid}", response_model=ICCIDInfo)
-async def get_iccid_info(iccid: str, api_key: str = Depends(get_api_key)):
+def format_iccid_info(iccid: str, response_data: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Get information about an eSIM using its ICCID, primarily from WordPress
+    Shape fetch_iccid_data output into the ICCIDInfo fields for its source
     """
-    if DEBUG_MODE:
-        print(f"ICCID lookup request received for: {iccid}")
+    # Check if data is empty or has error
+    if response_data.get("not_found", False) or not response_data.get("subscriber", {}):
+        if DEBUG_MODE:
+            print(f"No data found for ICCID: {iccid}")
+        raise HTTPException(
+            status_code=404, 
+            detail=f"No data found for ICCID: {iccid}. Please check the ICCID and try again."
+        )
     
-    try:
-        # Fetch data from WordPress as primary source, with fallbacks if needed
-        response_data = await fetch_iccid_data(iccid)
+    # Populate response based on the data source
+    data_source = response_data.get("source", "unknown")
+    
+    # Extract subscriber data
+    subscriber = response_data.get("subscriber", {})
+    packages = response_data.get("packages", [])
+    
+    # Initialize the response with the ICCID and data source
+    result = {
+        "iccid": iccid,
+        "data_source": data_source
+    }
+    
+    if data_source == "wordpress_primary":
+        # WordPress data format
+        result["subscriber_id"] = subscriber.get("sim_id", f"sub_{iccid[-6:]}")
+        result["status"] = subscriber.get("status", "active")
+        result["provider_reference"] = subscriber.get("sim_id", "")
+        result["country"] = subscriber.get("country", "")
+        result["network"] = subscriber.get("network", "")
+        result["last_updated"] = subscriber.get("last_updated", datetime.now().isoformat())
         
-        if DEBUG_MODE:
-            print(f"Data source: {response_data.get('source', 'unknown')}")
+        # Get data from the first package
+        if packages and len(packages) > 0:
+            active_package = packages[0]
             
-        # Check if data is empty or has error
-        if response_data.get("not_found", False) or not response_data.get("subscriber", {}):
-            if DEBUG_MODE:
-                print(f"No data found for ICCID: {iccid}")
-            raise HTTPException(
-                status_code=404, 
-                detail=f"No data found for ICCID: {iccid}. Please check the ICCID and try again."
-            )
-        
-        # Populate response based on the data source
-        data_source = response_data.get("source", "unknown")
+            result["activation_date"] = active_package.get("activation_date", "")
+            result["expiry_date"] = active_package.get("expiry_date", "")
+            result["plan_id"] = active_package.get("plan_id", "")
+            result["plan_name"] = active_package.get("plan_name", "")
+            result["total_data"] = active_package.get("total_data", "")
+            result["used_data"] = active_package.get("used_data", "")
+            result["remaining_data"] = active_package.get("remaining_data", "")
         
-        # Extract subscriber data
-        subscriber = response_data.get("subscriber", {})
-        packages = response_data.get("packages", [])
+    elif data_source == "telco_vision_fallback":
+        # Extract TelcoVision data
+        sim = subscriber.get("sim", {})
         
-        # Initialize the response with the ICCID and data source
-        result = {
-            "iccid": iccid,
-            "data_source": data_source
-        }
+        # Basic subscriber info
+        result["subscriber_id"] = sim.get("id", f"sub_{iccid[-6:]}")
+        result["status"] = sim.get("state", "UNKNOWN").lower()
+        result["provider_reference"] = sim.get("id", "")
+        result["last_updated"] = datetime.now().isoformat()
         
-        if data_source == "wordpress_primary":
-            # WordPress data format
-            result["subscriber_id"] = subscriber.get("sim_id", f"sub_{iccid[-6:]}")
-            result["status"] = subscriber.get("status", "active")
-            result["provider_reference"] = subscriber.get("sim_id", "")
-            result["country"] = subscriber.get("country", "")
-            result["network"] = subscriber.get("network", "")
-            result["last_updated"] = subscriber.get("last_updated", datetime.now().isoformat())
+        # Get data from the first active package
+        active_packages = [p for p in packages if p.get("active", False)]
+        if active_packages:
+            active_package = active_packages[0]
             
-            # Get data from the first package
-            if packages and len(packages) > 0:
-                active_package = packages[0]
-                
-                result["activation_date"] = active_package.get("activation_date", "")
-                result["expiry_date"] = active_package.get("expiry_date", "")
-                result["plan_id"] = active_package.get("plan_id", "")
-                result["plan_name"] = active_package.get("plan_name", "")
-                result["total_data"] = active_package.get("total_data", "")
-                result["used_data"] = active_package.get("used_data", "")
-                result["remaining_data"] = active_package.get("remaining_data", "")
+            # Get data from the package
+            result["activation_date"] = active_package.get("tsactivationutc", "")
+            result["expiry_date"] = active_package.get("tsexpirationutc", "")
+            result["plan_id"] = f"plan_{active_package.get('id', '')}"
+            # Get plan name from template
+            template = active_package.get("packageTemplate", {})
+            result["plan_name"] = template.get("name", "Unknown Plan")
             
-        elif data_source == "telco_vision_fallback":
-            # Extract TelcoVision data
-            sim = subscriber.get("sim", {})
+            # Calculate data usage
+            total_bytes = active_package.get("pckdatabyte", 0)
+            used_bytes = active_package.get("useddatabyte", 0)
+            remaining_bytes = total_bytes - used_bytes
             
-            # Basic subscriber info
-            result["subscriber_id"] = sim.get("id", f"sub_{iccid[-6:]}")
-            result["status"] = sim.get("state", "UNKNOWN").lower()
-            result["provider_reference"] = sim.get("id", "")
-            result["last_updated"] = datetime.now().isoformat()
+            # Convert to GB for display with 2 decimal places
+            def bytes_to_gb(bytes_val):
+                gb_val = bytes_val / (1024 * 1024 * 1024)
+                return f"{gb_val:.2f}GB"
             
-            # Get data from the first active package
-            active_packages = [p for p in packages if p.get("active", False)]
-            if active_packages:
-                active_package = active_packages[0]
-                
-                # Get data from the package
-                result["activation_date"] = active_package.get("tsactivationutc", "")
-                result["expiry_date"] = active_package.get("tsexpirationutc", "")
-                result["plan_id"] = f"plan_{active_package.get('id', '')}"
-                # Get plan name from template
-                template = active_package.get("packageTemplate", {})
-                result["plan_name"] = template.get("name", "Unknown Plan")
-                
-                # Calculate data usage
-                total_bytes = active_package.get("pckdatabyte", 0)
-                used_bytes = active_package.get("useddatabyte", 0)
-                remaining_bytes = total_bytes - used_bytes
-                
-                # Convert to GB for display with 2 decimal places
-                def bytes_to_gb(bytes_val):
-                    gb_val = bytes_val / (1024 * 1024 * 1024)
-                    return f"{gb_val:.2f}GB"
-                
-                result["total_data"] = bytes_to_gb(total_bytes)
-                result["used_data"] = bytes_to_gb(used_bytes)
-                result["remaining_data"] = bytes_to_gb(remaining_bytes)
+            result["total_data"] = bytes_to_gb(total_bytes)
+            result["used_data"] = bytes_to_gb(used_bytes)
+            result["remaining_data"] = bytes_to_gb(remaining_bytes)
+    
+    elif data_source == "sample_data":
+        # Sample data format
+        sim = subscriber.get("sim", {})
         
-        elif data_source == "sample_data":
-            # Sample data format
-            sim = subscriber.get("sim", {})
+        # Basic subscriber info
+        result["subscriber_id"] = sim.get("id", f"sub_{iccid[-6:]}")
+        result["status"] = sim.get("state", "ACTIVATED").lower()
+        result["provider_reference"] = sim.get("id", "")
+        result["last_updated"] = datetime.now().isoformat()
+        
+        # Get data from the first package
+        if packages and len(packages) > 0:
+            sample_package = packages[0]
             
-            # Basic subscriber info
-            result["subscriber_id"] = sim.get("id", f"sub_{iccid[-6:]}")
-            result["status"] = sim.get("state", "ACTIVATED").lower()
-            result["provider_reference"] = sim.get("id", "")
-            result["last_updated"] = datetime.now().isoformat()
+            # Get data from the sample package
+            result["activation_date"] = sample_package.get("tsactivationutc", "")
+            result["expiry_date"] = sample_package.get("tsexpirationutc", "")
+            result["plan_id"] = f"plan_{sample_package.get('id', '')}"
+            result["plan_name"] = sample_package.get("name", "Sample Plan")
             
-            # Get data from the first package
-            if packages and len(packages) > 0:
-                sample_package = packages[0]
-                
-                # Get data from the sample package
-                result["activation_date"] = sample_package.get("tsactivationutc", "")
-                result["expiry_date"] = sample_package.get("tsexpirationutc", "")
-                result["plan_id"] = f"plan_{sample_package.get('id', '')}"
-                result["plan_name"] = sample_package.get("name", "Sample Plan")
-                
-                # Calculate data usage
-                total_bytes = sample_package.get("pckdatabyte", 0)
-                used_bytes = sample_package.get("useddatabyte", 0)
-                remaining_bytes = total_bytes - used_bytes
-                
-                # Convert to GB for display
-                def bytes_to_gb(bytes_val):
-                    gb_val = bytes_val / (1024 * 1024 * 1024)
-                    return f"{gb_val:.2f}GB"
-                
-                result["total_data"] = bytes_to_gb(total_bytes)
-                result["used_data"] = bytes_to_gb(used_bytes)
-                result["remaining_data"] = bytes_to_gb(remaining_bytes)
+            # Calculate data usage
+            total_bytes = sample_package.get("pckdatabyte", 0)
+            used_bytes = sample_package.get("useddatabyte", 0)
+            remaining_bytes = total_bytes - used_bytes
+            
+            # Convert to GB for display
+            def bytes_to_gb(bytes_val):
+                gb_val = bytes_val / (1024 * 1024 * 1024)
+                return f"{gb_val:.2f}GB"
+            
+            result["total_data"] = bytes_to_gb(total_bytes)
+            result["used_data"] = bytes_to_gb(used_bytes)
+            result["remaining_data"] = bytes_to_gb(remaining_bytes)
+    
+    return result
+
+@app.get("/api/iccid/{iccid}", response_model=ICCIDInfo)
+async def get_iccid_info(iccid: str, api_key: str = Depends(get_api_key)):
+    """
+    Get information about an eSIM using its ICCID, primarily from WordPress
+    """
+    if DEBUG_MODE:
+        print(f"ICCID lookup request received for: {iccid}")
+    
+    try:
+        # Fetch data from WordPress as primary source, with fallbacks if needed
+        response_data = await iccid_cache.get(iccid, fetch_iccid_data)
+        
+        if DEBUG_MODE:
+            print(f"Data source: {response_data.get('source', 'unknown')}")
+            
+        result = format_iccid_info(iccid, response_data)
         
         if DEBUG_MODE:
             print(f"ICCID response data: {json.dumps(result)}")
@@ -1047,6 +3243,54 @@ async def get_iccid_info(iccid: str, api_key: str = Depends(get_api_key)):
             detail=f"Error processing ICCID request: {str(e)}"
         )
 
+class ICCIDBatchRequest(BaseModel):
+    iccids: List[str] = Field(..., min_length=1, max_length=ICCID_BATCH_MAX_SIZE, description="ICCIDs to look up")
+
+async def lookup_iccid_batch_item(index: int, iccid: str) -> Dict[str, Any]:
+    """
+    One line of a batch response: the ICCIDInfo for an ICCID, or its error
+    """
+    try:
+        response_data = await iccid_cache.get(iccid, fetch_iccid_data)
+        info = ICCIDInfo.model_validate(format_iccid_info(iccid, response_data))
+        return {"index": index, "iccid": iccid, "status": 200, "data": info.model_dump()}
+    except HTTPException as e:
+        return {"index": index, "iccid": iccid, "status": e.status_code, "error": e.detail}
+    except Exception as e:
+        print(f"Error processing ICCID {iccid} in batch: {str(e)}")
+        return {"index": index, "iccid": iccid, "status": 500, "error": f"Error processing ICCID request: {str(e)}"}
+
+async def stream_iccid_batch(iccids: List[str]):
+    """
+    Resolve ICCIDs ICCID_BATCH_CONCURRENCY at a time, yielding NDJSON lines as they complete
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    pending = iter(enumerate(iccids))
+    
+    async def worker():
+        # Workers share one iterator, so each ICCID is taken exactly once
+        for index, iccid in pending:
+            await results.put(await lookup_iccid_batch_item(index, iccid))
+    
+    workers = [asyncio.create_task(worker()) for _ in range(min(ICCID_BATCH_CONCURRENCY, len(iccids)))]
+    try:
+        for _ in iccids:
+            yield render_json(await results.get()) + b"\n"
+    finally:
+        # Stop looking up the rest if the client went away
+        for task in workers:
+            task.cancel()
+
+@app.post("/api/iccid/batch")
+async def get_iccid_info_batch(batch: ICCIDBatchRequest, api_key: str = Depends(get_api_key)):
+    """
+    Look up many ICCIDs at once, streaming one NDJSON line per ICCID as it resolves
+    """
+    if DEBUG_MODE:
+        print(f"ICCID batch lookup request received for {len(batch.iccids)} ICCIDs")
+    
+    return StreamingResponse(stream_iccid_batch(batch.iccids), media_type="application/x-ndjson")
+
 # SimTLV API Endpoints
 @app.post("/api/subscribers/identify", response_model=SubscriberResponse)
 async def identify_subscriber(request: SubscriberRequest, api_key: str = Depends(get_api_key)):
@@ -1068,15 +3312,16 @@ async def get_plans(api_key: str = Depends(get_api_key)):
     # For now, we'll use placeholder data that references our products
     plans = []
     
-    if data_store.products:
-        for product in data_store.products[:5]:  # Convert first 5 products to plans
+    snapshot = data_store.snapshot
+    if snapshot.products:
+        for position, product in enumerate(snapshot.products[:5]):  # Convert first 5 products to plans
             plans.append({
                 "plan_id": product.get("Product_id", "unknown"),
                 "name": product.get("Product_name", "Unknown Plan"),
                 "description": f"eSIM plan with {product.get('GB', '0')} for {product.get('Days', '0')} days",
                 "data_amount": product.get("GB", "0GB"),
-                "validity_days": int(product.get("Days", 0)),
-                "price": float(product.get("Price_USD_5", 0)) if product.get("Price_USD_5") else 0.0,
+                "validity_days": snapshot.days[position] or 0,
+                "price": 0.0 if math.isnan(snapshot.price_matrix[0][position]) else snapshot.price_matrix[0][position],
                 "currency": "USD"
             })
     
@@ -1196,36 +3441,27 @@ async def fetch_topup_plans() -> List[Dict[str, Any]]:
         print("Fetching topup plans from WordPress")
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Set up WordPress API URL for topup plans
-            url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/topup-plans"
-            
-            # Set up authentication headers
-            headers = {}
-            if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD:
-                # Remove spaces from app password if present
-                app_password = WORDPRESS_APP_PASSWORD.replace(" ", "")
-                import base64
-                auth_string = f"{WORDPRESS_APP_USERNAME}:{app_password}"
-                encoded_auth = base64.b64encode(auth_string.encode()).decode()
-                headers["Authorization"] = f"Basic {encoded_auth}"
-            elif API_KEY:
-                headers["Authorization"] = f"Bearer {API_KEY}"
-            
-            if DEBUG_MODE:
-                print(f"Making request to WordPress API: {url}")
+        client = upstream_clients.get("wordpress")
+        # Set up WordPress API URL for topup plans
+        url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/topup-plans"
+        
+        # Set up authentication headers
+        headers = dict(WORDPRESS_AUTH_HEADERS)
+        
+        if DEBUG_MODE:
+            print(f"Making request to WordPress API: {url}")
+        
+        try:
+            response = await client.get(url, headers=headers, timeout=30.0)
             
-            try:
-                response = await client.get(url, headers=headers, timeout=30.0)
-                
-                if response.status_code == 200:
-                    return response.json().get("plans", [])
-                else:
-                    print(f"Error fetching topup plans: HTTP {response.status_code} - {response.text}")
-                    return []
-            except httpx.RequestError as e:
-                print(f"Error connecting to WordPress for topup plans: {str(e)}")
+            if response.status_code == 200:
+                return response.json().get("plans", [])
+            else:
+                print(f"Error fetching topup plans: HTTP {response.status_code} - {response.text}")
                 return []
+        except httpx.RequestError as e:
+            print(f"Error connecting to WordPress for topup plans: {str(e)}")
+            return []
     except Exception as e:
         print(f"General error fetching topup plans: {str(e)}")
         return []
@@ -1236,66 +3472,57 @@ async def execute_topup(iccid: str, plan_id: str, payment_reference: Optional[st
         print(f"Executing topup for ICCID {iccid} with plan {plan_id}")
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Set up WordPress API URL for topup execution
-            url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/execute-topup"
-            
-            # Set up authentication headers
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD:
-                # Remove spaces from app password if present
-                app_password = WORDPRESS_APP_PASSWORD.replace(" ", "")
-                import base64
-                auth_string = f"{WORDPRESS_APP_USERNAME}:{app_password}"
-                encoded_auth = base64.b64encode(auth_string.encode()).decode()
-                headers["Authorization"] = f"Basic {encoded_auth}"
-            elif API_KEY:
-                headers["Authorization"] = f"Bearer {API_KEY}"
-            
-            # Prepare payload
-            payload = {
-                "iccid": iccid,
-                "plan_id": plan_id
-            }
-            
-            if payment_reference:
-                payload["payment_reference"] = payment_reference
-            
-            if DEBUG_MODE:
-                print(f"Making request to WordPress API: {url}")
-                print(f"Payload: {payload}")
+        client = upstream_clients.get("wordpress")
+        # Set up WordPress API URL for topup execution
+        url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/execute-topup"
+        
+        # Set up authentication headers
+        headers = {
+            "Content-Type": "application/json",
+            **WORDPRESS_AUTH_HEADERS
+        }
+        
+        # Prepare payload
+        payload = {
+            "iccid": iccid,
+            "plan_id": plan_id
+        }
+        
+        if payment_reference:
+            payload["payment_reference"] = payment_reference
+        
+        if DEBUG_MODE:
+            print(f"Making request to WordPress API: {url}")
+            print(f"Payload: {payload}")
+        
+        try:
+            response = await client.post(url, headers=headers, json=payload, timeout=60.0)
             
-            try:
-                response = await client.post(url, headers=headers, json=payload, timeout=60.0)
+            if response.status_code == 200:
+                return response.json()
+            else:
+                error_message = f"Error executing topup: HTTP {response.status_code}"
+                try:
+                    error_data = response.json()
+                    if "message" in error_data:
+                        error_message = error_data["message"]
+                except:
+                    error_message += f" - {response.text}"
                 
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    error_message = f"Error executing topup: HTTP {response.status_code}"
-                    try:
-                        error_data = response.json()
-                        if "message" in error_data:
-                            error_message = error_data["message"]
-                    except:
-                        error_message += f" - {response.text}"
-                    
-                    return {
-                        "status": "error",
-                        "message": error_message,
-                        "iccid": iccid,
-                        "plan_id": plan_id
-                    }
-            except httpx.RequestError as e:
-                print(f"Error connecting to WordPress for topup execution: {str(e)}")
                 return {
                     "status": "error",
-                    "message": f"Connection error: {str(e)}",
+                    "message": error_message,
                     "iccid": iccid,
                     "plan_id": plan_id
                 }
+        except httpx.RequestError as e:
+            print(f"Error connecting to WordPress for topup execution: {str(e)}")
+            return {
+                "status": "error",
+                "message": f"Connection error: {str(e)}",
+                "iccid": iccid,
+                "plan_id": plan_id
+            }
     except Exception as e:
         print(f"General error executing topup: {str(e)}")
         return {
@@ -1311,46 +3538,37 @@ async def get_topup_history(iccid: str) -> Dict[str, Any]:
         print(f"Getting topup history for ICCID {iccid}")
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Set up WordPress API URL for topup history
-            url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/topup-history/{iccid}"
-            
-            # Set up authentication headers
-            headers = {}
-            if WORDPRESS_APP_USERNAME and WORDPRESS_APP_PASSWORD:
-                # Remove spaces from app password if present
-                app_password = WORDPRESS_APP_PASSWORD.replace(" ", "")
-                import base64
-                auth_string = f"{WORDPRESS_APP_USERNAME}:{app_password}"
-                encoded_auth = base64.b64encode(auth_string.encode()).decode()
-                headers["Authorization"] = f"Basic {encoded_auth}"
-            elif API_KEY:
-                headers["Authorization"] = f"Bearer {API_KEY}"
-            
-            if DEBUG_MODE:
-                print(f"Making request to WordPress API: {url}")
+        client = upstream_clients.get("wordpress")
+        # Set up WordPress API URL for topup history
+        url = f"{WORDPRESS_URL}/wp-json/esim-global/v1/topup-history/{iccid}"
+        
+        # Set up authentication headers
+        headers = dict(WORDPRESS_AUTH_HEADERS)
+        
+        if DEBUG_MODE:
+            print(f"Making request to WordPress API: {url}")
+        
+        try:
+            response = await client.get(url, headers=headers, timeout=30.0)
             
-            try:
-                response = await client.get(url, headers=headers, timeout=30.0)
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"Error fetching topup history: HTTP {response.status_code} - {response.text}")
-                    return {
-                        "status": "error",
-                        "iccid": iccid,
-                        "history": [],
-                        "count": 0
-                    }
-            except httpx.RequestError as e:
-                print(f"Error connecting to WordPress for topup history: {str(e)}")
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"Error fetching topup history: HTTP {response.status_code} - {response.text}")
                 return {
                     "status": "error",
                     "iccid": iccid,
                     "history": [],
                     "count": 0
                 }
+        except httpx.RequestError as e:
+            print(f"Error connecting to WordPress for topup history: {str(e)}")
+            return {
+                "status": "error",
+                "iccid": iccid,
+                "history": [],
+                "count": 0
+            }
     except Exception as e:
         print(f"General error fetching topup history: {str(e)}")
         return {
@@ -1394,6 +3612,8 @@ async def execute_topup_endpoint(
         request.plan_id,
         request.payment_reference
     )
+    # Cached lookups for this ICCID predate the topup
+    iccid_cache.invalidate(request.iccid)
     
     if result.get("status") == "error":
         raise HTTPException(
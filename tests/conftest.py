@@ -0,0 +1,11 @@
+import os
+import sys
+
+# main reads its configuration at import time; keep tests offline and quiet
+os.environ.setdefault("CONNECTION_ERROR_TEST", "true")
+os.environ.setdefault("DEBUG_MODE", "false")
+os.environ.setdefault("FASTAPI_API_KEY", "test")
+os.environ.pop("SHARED_CATALOG_DIR", None)
+os.environ.pop("CATALOG_CACHE_FILE", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
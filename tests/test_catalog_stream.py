@@ -0,0 +1,164 @@
+"""Byte-level catalog handling: the streaming decoder and the spliced gzip bodies."""
+import gzip
+import hashlib
+import json
+
+import pytest
+
+import main
+
+
+PAYLOAD = {
+    "meta": {"nested": [1, 2.5, {"deep": [None, True, False]}], "text": "é☃ \"quoted\" \\ \n"},
+    "products": [
+        {
+            "Product_id": f"p{i}",
+            "Product_name": f"Plan {i} – Ünïcödé 🌍",
+            "GB": f"{i + 1}GB",
+            "Days": str(7 * (i + 1)),
+            "Price_group": str(i % 5 + 1),
+            "Price_USD_5": f"{1500.25 + i}",
+            "auto_refill": i % 2,
+            "extra_field1": None,
+        }
+        for i in range(12)
+    ],
+    "countries": [
+        {"Country_Code": "GB", "Country_Region": "Europe", "IS_REGION": 0, "Price_group": "2"},
+        {"Country_Code": "\"Q\"", "Country_Region": "Ωmega", "IS_REGION": 1, "Price_group": "1"},
+    ],
+    "count": -1.5e3,
+}
+
+
+def encode(payload, **kwargs) -> bytes:
+    return json.dumps(payload, **kwargs).encode()
+
+
+def decode(raw: bytes, chunk_size: int):
+    records = {"products": [], "countries": []}
+    decoder = main.CatalogStreamDecoder(lambda section, record: records[section].append(record))
+    for start in range(0, len(raw), chunk_size):
+        decoder.feed(raw[start:start + chunk_size])
+    decoder.close()
+    return records
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 64, 1 << 20])
+@pytest.mark.parametrize("options", [{}, {"indent": 2}, {"ensure_ascii": False}])
+def test_decoder_matches_json_loads_for_any_chunk_size(chunk_size, options):
+    records = decode(encode(PAYLOAD, **options), chunk_size)
+    assert records["products"] == PAYLOAD["products"]
+    assert records["countries"] == PAYLOAD["countries"]
+
+
+def test_decoder_handles_every_two_chunk_split():
+    # Every split point, including inside numbers, strings, escapes and multi-byte characters
+    payload = {"products": [{"Price": 1500.25, "Name": "é\\\"☃", "n": -12e-3, "t": True, "z": None}], "countries": []}
+    raw = encode(payload, ensure_ascii=False)
+    for split in range(1, len(raw)):
+        records = {"products": [], "countries": []}
+        decoder = main.CatalogStreamDecoder(lambda section, record: records[section].append(record))
+        decoder.feed(raw[:split])
+        decoder.feed(raw[split:])
+        decoder.close()
+        assert records["products"] == payload["products"], split
+
+
+def test_decoder_does_not_accept_a_number_cut_by_a_chunk_boundary():
+    records = []
+    decoder = main.CatalogStreamDecoder(lambda section, record: records.append(record))
+    decoder.feed(b'{"products":[{"Price":15')
+    decoder.feed(b"00.")
+    decoder.feed(b"25}]}")
+    decoder.close()
+    assert records == [{"Price": 1500.25}]
+
+
+@pytest.mark.parametrize("raw", [b'{"products":null}', b'{"other":[1,2]}', b"{}"])
+def test_decoder_treats_missing_sections_as_empty(raw):
+    assert decode(raw, 1) == {"products": [], "countries": []}
+
+
+def test_decoder_rejects_every_truncation():
+    raw = encode(PAYLOAD)
+    for cut in range(len(raw)):
+        decoder = main.CatalogStreamDecoder(lambda section, record: None)
+        with pytest.raises(ValueError):
+            decoder.feed(raw[:cut])
+            decoder.close()
+
+
+@pytest.mark.parametrize("raw", [
+    b'{"products":[{"a":1}',
+    b'{"products":[1 2]}',
+    b'{"products":[{"a":1},]}',
+    b'{"products" [] }',
+    b'{"products":[{"a":tru}]}',
+    b"[1]",
+    b'{"a":1',
+    b'{"a":1}}',
+    b"\xff\xfe",
+])
+def test_decoder_rejects_malformed_input(raw):
+    decoder = main.CatalogStreamDecoder(lambda section, record: None)
+    with pytest.raises(ValueError):
+        decoder.feed(raw)
+        decoder.close()
+
+
+def test_streamed_ingest_builds_the_same_snapshot_as_a_buffered_body():
+    raw = encode(PAYLOAD, indent=1)
+    current = main.CatalogSnapshot(0, [], [], None)
+    buffered, _, _ = main.build_catalog_from_payload(current, raw, None, None, None)
+
+    ingest = main.CatalogIngest(current)
+    for start in range(0, len(raw), 7):
+        ingest.feed(raw[start:start + 7])
+    streamed, validators, _ = main.build_catalog_from_stream(ingest, None, None)
+
+    assert validators["content_hash"] == hashlib.sha256(raw).hexdigest()
+    assert streamed.etag == buffered.etag
+    assert streamed.products_body.identity == buffered.products_body.identity
+    assert streamed.countries_body.identity == buffered.countries_body.identity
+
+
+@pytest.mark.parametrize("identity", [b"", b"{}", encode(PAYLOAD), bytes(range(256)) * 200])
+def test_encoded_body_variants_round_trip(identity):
+    body = main.EncodedBody(identity)
+    assert gzip.decompress(body.render("gzip")) == identity
+    if main.brotli is not None:
+        assert main.brotli.decompress(body.render("br")) == identity
+
+
+@pytest.mark.parametrize("head, tail", [
+    (b"", b""),
+    (b'{"products":[],"timestamp":', b',"last_updated":null}'),
+    (encode(PAYLOAD)[:-1] + b',"timestamp":', b',"last_updated":"2024-01-01 00:00:00"}'),
+    (bytes(range(256)) * 300, b"tail" * 1000),
+])
+def test_timestamped_body_gzip_is_a_valid_member(head, tail, monkeypatch):
+    monkeypatch.setattr(main.time, "time", lambda: 1700000000.9)
+    body = main.TimestampedBody(head, tail)
+    identity = body.render()
+    assert identity == head + b"1700000000" + tail
+    # gzip.decompress checks the spliced CRC-32 and length trailer
+    assert gzip.decompress(body.render("gzip")) == identity
+
+
+def test_timestamped_body_renders_a_fresh_timestamp_each_time(monkeypatch):
+    body = main.TimestampedBody(b'{"timestamp":', b"}")
+    for now in (1, 1700000000, 4102444800):
+        monkeypatch.setattr(main.time, "time", lambda now=now: now)
+        assert json.loads(gzip.decompress(body.render("gzip"))) == {"timestamp": now}
+
+
+def test_snapshot_file_keeps_gzip_bodies_valid(tmp_path):
+    snapshot = main.data_store.build(PAYLOAD["products"], PAYLOAD["countries"], previous=main.CatalogSnapshot(0, [], [], None))
+    path = str(tmp_path / "catalog.bin")
+    main.write_snapshot_file(path, snapshot)
+    loaded = main.read_snapshot_file(path)
+
+    assert loaded.etag == snapshot.etag
+    assert gzip.decompress(loaded.products_body.render("gzip")) == bytes(snapshot.products_body.identity)
+    assert gzip.decompress(loaded.esim_data_body.render("gzip")) == loaded.esim_data_body.render()
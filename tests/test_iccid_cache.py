@@ -0,0 +1,231 @@
+"""The ICCID lookup cache: TTLs, stale-while-revalidate, invalidation and negative caching."""
+import asyncio
+import types
+
+import pytest
+
+import main
+
+
+WORDPRESS = {"subscriber": {"sim": {"id": "s1"}}, "packages": [], "source": "wordpress_primary"}
+TELCOVISION = {"subscriber": {"sim": {"id": "s1"}}, "packages": [], "source": "telco_vision_fallback"}
+NOT_FOUND = {"subscriber": {}, "packages": [], "not_found": True, "status_code": 404, "source": "wordpress_fallback"}
+ERROR = {"subscriber": {}, "packages": [], "error": "WordPress API returned 503", "source": "wordpress_fallback"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A manual clock for the cache; the event loop keeps the real one"""
+    now = [1000.0]
+    monkeypatch.setattr(main, "time", types.SimpleNamespace(monotonic=lambda: now[0], time=main.time.time))
+    return now
+
+
+class Upstream:
+    """A fetch function that returns queued results and counts calls"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+        self.gate = None
+
+    async def __call__(self, iccid):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.parametrize("result, expected", [
+    (WORDPRESS, (main.ICCID_CACHE_TTL_WORDPRESS, main.ICCID_CACHE_STALE_TTL)),
+    (TELCOVISION, (main.ICCID_CACHE_TTL_TELCOVISION, main.ICCID_CACHE_STALE_TTL)),
+    (NOT_FOUND, (main.ICCID_CACHE_TTL_NOT_FOUND, 0)),
+    ({**NOT_FOUND, "status_code": 429}, None),
+    ({"subscriber": {}, "packages": [], "not_found": True}, None),
+    (ERROR, None),
+    ({**TELCOVISION, "partial_data": True}, None),
+    ({**WORDPRESS, "source": "sample_data"}, None),
+])
+def test_ttls(result, expected):
+    assert main.ICCIDCache.ttls(result) == expected
+
+
+def test_fresh_results_are_served_from_the_cache(clock):
+    cache = main.ICCIDCache(10)
+    upstream = Upstream(WORDPRESS)
+
+    async def scenario():
+        assert await cache.get("1", upstream) == WORDPRESS
+        clock[0] += main.ICCID_CACHE_TTL_WORDPRESS - 1
+        assert await cache.get("1", upstream) == WORDPRESS
+
+    asyncio.run(scenario())
+    assert upstream.calls == 1
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_stale_results_are_served_while_one_refresh_runs(clock):
+    cache = main.ICCIDCache(10)
+    refreshed = {**WORDPRESS, "packages": [{"id": "new"}]}
+    upstream = Upstream(WORDPRESS, refreshed)
+
+    async def scenario():
+        await cache.get("1", upstream)
+        clock[0] += main.ICCID_CACHE_TTL_WORDPRESS + 1
+        upstream.gate = asyncio.Event()
+        assert await cache.get("1", upstream) == WORDPRESS
+        assert await cache.get("1", upstream) == WORDPRESS
+        upstream.gate.set()
+        await settle()
+        assert await cache.get("1", upstream) == refreshed
+
+    asyncio.run(scenario())
+    assert upstream.calls == 2
+    assert cache.stats["stale_hits"] == 2
+
+
+def test_failed_refresh_keeps_the_entry_until_the_stale_window_ends(clock):
+    cache = main.ICCIDCache(10)
+    upstream = Upstream(WORDPRESS, ERROR)
+
+    async def scenario():
+        await cache.get("1", upstream)
+        clock[0] += main.ICCID_CACHE_TTL_WORDPRESS + 1
+        assert await cache.get("1", upstream) == WORDPRESS
+        await settle()
+        assert await cache.get("1", upstream) == WORDPRESS
+        clock[0] += main.ICCID_CACHE_STALE_TTL
+        assert await cache.get("1", upstream) == ERROR
+
+    asyncio.run(scenario())
+    assert "1" not in cache.entries
+
+
+def test_concurrent_misses_share_one_fetch(clock):
+    cache = main.ICCIDCache(10)
+    upstream = Upstream(WORDPRESS)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("1", upstream) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [WORDPRESS] * 5
+    assert upstream.calls == 1
+
+
+def test_invalidation_discards_a_fetch_in_flight(clock):
+    cache = main.ICCIDCache(10)
+    before, after = {**WORDPRESS, "packages": [{"id": "before"}]}, {**WORDPRESS, "packages": [{"id": "after"}]}
+    upstream = Upstream(before, after)
+
+    async def scenario():
+        upstream.gate = asyncio.Event()
+        waiting = asyncio.ensure_future(cache.get("1", upstream))
+        await settle()
+        cache.invalidate("1")
+        upstream.gate.set()
+        # Whoever was waiting still gets the answer, but it is not cached
+        assert await waiting == before
+        assert "1" not in cache.entries
+        assert await cache.get("1", upstream) == after
+
+    asyncio.run(scenario())
+    assert upstream.calls == 2
+
+
+def test_invalidation_reaches_other_workers_through_the_shared_file(clock, tmp_path):
+    # Two caches on one file stand in for two gunicorn workers
+    worker, other = main.ICCIDCache(10), main.ICCIDCache(10)
+    worker.open(str(tmp_path))
+    other.open(str(tmp_path))
+    before, after = {**WORDPRESS, "packages": [{"id": "before"}]}, {**WORDPRESS, "packages": [{"id": "after"}]}
+    upstream = Upstream(before, before, before, after)
+
+    async def scenario():
+        await other.get("1", upstream)
+        other.invalidate("2")
+        # Another worker's topup drops the entry here too, fresh or not
+        worker.invalidate("1")
+        assert await other.get("1", upstream) == before
+        assert upstream.calls == 2
+        # ...and a lookup joining a fetch from before the topup starts a new one
+        worker.invalidate("1")
+        upstream.gate = asyncio.Event()
+        waiting = asyncio.ensure_future(other.get("1", upstream))
+        await settle()
+        worker.invalidate("1")
+        joined = asyncio.ensure_future(other.get("1", upstream))
+        await settle()
+        upstream.gate.set()
+        assert await waiting == before
+        assert await joined == after
+        assert other.entries["1"][0] == after
+
+    asyncio.run(scenario())
+    assert upstream.calls == 4
+
+
+def test_only_a_404_is_negatively_cached(clock):
+    cache = main.ICCIDCache(10)
+    throttled = {**NOT_FOUND, "status_code": 429}
+    upstream = Upstream(NOT_FOUND, throttled)
+
+    async def scenario():
+        await cache.get("404", upstream)
+        assert await cache.get("404", upstream) == NOT_FOUND
+        await cache.get("429", upstream)
+        await cache.get("429", upstream)
+        clock[0] += main.ICCID_CACHE_TTL_NOT_FOUND
+        await cache.get("404", upstream)
+
+    asyncio.run(scenario())
+    assert cache.stats["negative_hits"] == 1
+    assert upstream.calls == 4
+
+
+@pytest.mark.parametrize("telcovision", [None, {**ERROR, "source": "telco_vision_fallback"}])
+def test_wordpress_404_is_returned_when_telcovision_has_no_answer(monkeypatch, telcovision):
+    async def wordpress(iccid):
+        return dict(NOT_FOUND)
+
+    async def fallback(iccid):
+        return telcovision
+
+    monkeypatch.setattr(main, "fetch_iccid_data_from_wordpress", wordpress)
+    monkeypatch.setattr(main, "fetch_iccid_data_fallback", fallback)
+    monkeypatch.setenv("ALLOW_SAMPLE_DATA_FALLBACK", "true")
+    result = asyncio.run(main.fetch_iccid_data("1"))
+    assert result["not_found"] and result["status_code"] == 404
+    assert main.ICCIDCache.ttls(result) == (main.ICCID_CACHE_TTL_NOT_FOUND, 0)
+
+
+def test_telcovision_answer_wins_over_a_wordpress_404(monkeypatch):
+    async def wordpress(iccid):
+        return dict(NOT_FOUND)
+
+    async def fallback(iccid):
+        return TELCOVISION
+
+    monkeypatch.setattr(main, "fetch_iccid_data_from_wordpress", wordpress)
+    monkeypatch.setattr(main, "fetch_iccid_data_fallback", fallback)
+    assert asyncio.run(main.fetch_iccid_data("1")) == TELCOVISION
+
+
+def test_hedged_lookup_returns_the_wordpress_404(monkeypatch):
+    async def primary(iccid):
+        await asyncio.sleep(0.05)
+        return dict(NOT_FOUND)
+
+    async def fallback(iccid):
+        return None
+
+    monkeypatch.setattr(main, "fetch_iccid_data_primary", primary)
+    monkeypatch.setattr(main, "fetch_iccid_data_fallback", fallback)
+    hedge = main.ICCIDHedge(True, 95, 0.0, 0.0, 10)
+    result = asyncio.run(hedge.race("1"))
+    assert result["status_code"] == 404
+    assert hedge.stats["hedged"] == 1 and hedge.stats["no_winner"] == 1